@@ -0,0 +1,211 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+import standins  # noqa: E402
+
+# End-to-end benchmark that needs no network: starts the stand-ins for baiscope, TMDB and Telegram in a separate
+# process, points the bot at them and feeds the real bot.py handlers synthetic updates, like webhook.py does.
+# Reports updates/sec, latency per command and per stage (from helpers/metrics.py) and the peak RSS of the bot.
+#
+#   python3 benchmarks/e2e_benchmark.py --sessions 40 --concurrency 8 --baiscope-ms 80
+#
+# Everything the bot writes (database, subtitles, logs) goes to a temporary directory that is removed afterwards.
+
+
+class Updates:
+    # Builds the update JSON Telegram would send, from a given user and chat
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def _id(self):
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def _message(self, user_id, text):
+        return {'message_id': self._id(), 'date': int(time.time()), 'text': text,
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}}
+
+    def message(self, user_id, text):
+        return {'update_id': self._id(), 'message': self._message(user_id, text)}
+
+    def callback(self, user_id, data):
+        return {'update_id': self._id(), 'callback_query': {
+            'id': str(self._id()), 'data': data, 'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'message': self._message(user_id, '')}}
+
+    def inline(self, user_id, query, offset=''):
+        return {'update_id': self._id(), 'inline_query': {
+            'id': str(self._id()), 'query': query, 'offset': offset,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}}}
+
+
+def movie_session(updates, user_id, rng):
+    # Every movie search gets the same fixture page and /movie lists the first five movies on it
+    title = rng.choice(standins.MOVIES[:5])
+    return [('/movie', updates.message(user_id, f'/movie {title}')),
+            ('/dl', updates.message(user_id, f'/dl_{standins.title_id(title)}'))]
+
+
+def series_session(updates, user_id, rng):
+    name = rng.choice(standins.SERIES)
+    series_id = standins.title_id(name)
+    season = rng.randint(1, 3)
+    return [('/tv', updates.message(user_id, f'/tv {name}')),
+            ('/s', updates.message(user_id, f'/s_{series_id}')),
+            ('season', updates.callback(user_id, f'series_{series_id}_season_{season}')),
+            ('episode', updates.callback(user_id, f'episode_10_season_{season}_series_id_{series_id}')),
+            ('zip', updates.callback(user_id, f'zip_{series_id}_season_{season}')),
+            ('inline', updates.inline(user_id, name[:3]))]
+
+
+def build_sessions(count, movie_ratio, seed):
+    rng = random.Random(seed)
+    updates = Updates()
+    sessions = []
+    for user_id in range(1000, 1000 + count):
+        build = movie_session if rng.random() < movie_ratio else series_session
+        sessions.append(build(updates, user_id, rng))
+    return sessions
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def run_round(bot, types, sessions, concurrency):
+    latencies = {}
+    lock = threading.Lock()
+
+    def run_session(session):
+        # A user's updates arrive one after the other, different users run concurrently
+        for command, data in session:
+            update = types.Update.de_json(data)
+            start = time.perf_counter()
+            bot.process_new_updates([update])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.setdefault(command, []).append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_session, sessions))
+    return time.perf_counter() - start, latencies
+
+
+def print_latencies(title, rows):
+    print(f"\n{title:<32} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, count, p50, p95, slowest in rows:
+        print(f"{name[:32]:<32} {count:>6} {p50 * 1000:>9.1f} {p95 * 1000:>9.1f} {slowest * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of the bot handlers')
+    parser.add_argument('--sessions', type=int, default=40, help='user sessions per round')
+    parser.add_argument('--concurrency', type=int, default=8, help='sessions handled at the same time')
+    parser.add_argument('--rounds', type=int, default=2, help='rounds over the same sessions, the first one is cold')
+    parser.add_argument('--movie-ratio', type=float, default=0.5, help='share of movie sessions, the rest are tv')
+    parser.add_argument('--baiscope-ms', type=float, default=50, help='added latency of the baiscope stand-in')
+    parser.add_argument('--tmdb-ms', type=float, default=30, help='added latency of the TMDB stand-in')
+    parser.add_argument('--telegram-ms', type=float, default=20, help='added latency of the Telegram stand-in')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    args = parser.parse_args()
+
+    latencies = {'baiscope': args.baiscope_ms / 1000, 'tmdb': args.tmdb_ms / 1000, 'telegram': args.telegram_ms / 1000}
+    ports = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=standins.run, args=(latencies, ports, stop), daemon=True)
+    process.start()
+    urls = ports.get(timeout=60)
+    # The http.<host> stages in the report are named after these
+    print('Stand-ins: ' + ', '.join(f'{name} {url}' for name, url in urls.items()))
+
+    workdir = tempfile.mkdtemp(prefix='bot-benchmark-')
+    # Set before the bot is imported, load_dotenv() doesn't override variables that are already set
+    os.environ.update({
+        'TOKEN': '123456:BENCHMARK', 'TMDB_API_KEY': 'benchmark', 'HOST_URL': urls['baiscope'],
+        'TMDB_API_URL': urls['tmdb'] + '/3', 'TELEGRAM_API_URL': urls['telegram'], 'TELEGRAM_LOGGING': 'False',
+        'PREWARM_INTERVAL': '0', 'METRICS_PORT': '0',
+    })
+    os.chdir(workdir)
+    os.makedirs('connectors')
+    sys.path.insert(0, REPO)
+    try:
+        import bot as bot_module
+        from telebot import types
+        from config import logging as bot_logging
+        from helpers import metrics
+
+        # Keep the terminal for the report, the bot still logs to logs/bot.log in the working directory
+        bot_logging.stream_handler.setLevel(logging.CRITICAL)
+        errors = ErrorCounter()
+        # The bot's own logger propagates to the root logger too
+        logging.getLogger().addHandler(errors)
+        # Handlers run on our threads, like in webhook.py
+        bot = bot_module.bot
+        bot.threaded = False
+
+        sessions = build_sessions(args.sessions, args.movie_ratio, args.seed)
+        total_updates = sum(len(session) for session in sessions)
+        for round_number in range(1, args.rounds + 1):
+            wall, round_latencies = run_round(bot, types, sessions, args.concurrency)
+            label = 'cold' if round_number == 1 else 'warm'
+            print(f"\nRound {round_number} ({label}): {total_updates} updates from {len(sessions)} sessions in "
+                  f"{wall:.2f}s, {total_updates / wall:.1f} updates/sec")
+            print_latencies('command', [(name, len(values), percentile(sorted(values), 50),
+                                         percentile(sorted(values), 95), max(values))
+                                        for name, values in sorted(round_latencies.items())])
+
+        snapshot = metrics.snapshot()
+        print_latencies('stage (all rounds)', [(name, stage['count'], stage['p50'], stage['p95'], stage['max'])
+                                               for name, stage in sorted(snapshot['stages'].items())])
+        print(f"\nErrors logged: {errors.count}")
+        print(f"Peak RSS of the bot process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    finally:
+        stop.set()
+        try:
+            print(f"Stand-in requests: {ports.get(timeout=10)}")
+        except Exception:
+            pass
+        process.join(5)
+        os.chdir(REPO)
+        if args.keep:
+            print(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
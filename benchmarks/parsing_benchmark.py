@@ -0,0 +1,66 @@
+import os
+import sys
+import timeit
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from helpers import parsing  # noqa: E402
+
+# Compares helpers/parsing.py against the BeautifulSoup + html.parser scraping it replaced, on pages saved in
+# benchmarks/fixtures. Run it from anywhere with `python3 benchmarks/parsing_benchmark.py [iterations]`.
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGE_URL = 'https://www.baiscope.lk/loki-s02-e01/'
+
+
+def soup_search_page(text):
+    soup = BeautifulSoup(text, 'html.parser')
+    posts = []
+    for h2 in soup.find_all('h2', class_='entry-title'):
+        a = h2.find('a', href=True)
+        cat_links = h2.find_next('span', class_='cat-links')
+        categories = [c.text.strip() for c in cat_links.find_all('a')] if cat_links is not None else []
+        posts.append(parsing.Post(a.text, a['href'], categories))
+    page_numbers = soup.find_all('a', class_='page-numbers')
+    max_page = max((int(a.text) for a in page_numbers if a.text.isdigit()), default=1)
+    return parsing.SearchPage(posts, max_page)
+
+
+def soup_download_link(text, page_url):
+    soup = BeautifulSoup(text, 'html.parser')
+    for a in soup.find_all('a', href=True):
+        if '/?tmstv=' in a['href']:
+            return urljoin(page_url, a['href'])
+    return None
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def bench(label, old, new, number):
+    old_time = min(timeit.repeat(old, number=number, repeat=3)) / number
+    new_time = min(timeit.repeat(new, number=number, repeat=3)) / number
+    print(f"{label:<20} html.parser {old_time * 1000:8.2f} ms   lxml {new_time * 1000:8.2f} ms   "
+          f"{old_time / new_time:5.1f}x")
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for name in ('search_series.html', 'search_movies.html'):
+        text = load(name)
+        # Both parsers have to agree before their speed means anything
+        assert parsing.parse_search_page(text) == soup_search_page(text), name
+        bench(name, lambda: soup_search_page(text), lambda: parsing.parse_search_page(text), number)
+
+    text = load('post.html')
+    assert parsing.find_download_link(text, PAGE_URL) == soup_download_link(text, PAGE_URL)
+    bench('post.html', lambda: soup_download_link(text, PAGE_URL), lambda: parsing.find_download_link(text, PAGE_URL),
+          number)
+
+
+if __name__ == '__main__':
+    main()
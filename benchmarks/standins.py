@@ -0,0 +1,251 @@
+import io
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import py7zr
+
+# Local stand-ins for baiscope, TMDB and the Telegram Bot API, used by e2e_benchmark.py so the bot can be driven
+# without any network access. baiscope pages are the saved fixtures with their links pointed back at the stand-in,
+# archives are generated once at startup, TMDB and Telegram answer with the minimum the bot reads.
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED_HOST = 'https://www.baiscope.lk'
+
+SERIES = ['Loki', 'The Last of Us', 'House of the Dragon', 'The Boys', 'Stranger Things', 'The Witcher', 'Wednesday',
+          'Reacher']
+# The titles on the movie search fixture, searched on TMDB without the year
+MOVIES = ['Oppenheimer', 'Barbie', 'Dune', 'Titanic', 'Avatar', 'Interstellar', 'Inception', 'The Batman', 'Joker',
+          'Top Gun Maverick']
+
+ARCHIVE_TYPES = {
+    'zip': 'application/zip',
+    'rar': 'application/x-rar-compressed',
+    '7z': 'application/x-7z-compressed',
+}
+
+
+def title_id(title):
+    # Stable TMDB id for a title, the harness uses it to build /dl_ and /s_ commands
+    return zlib.crc32(title.lower().encode()) % 900000 + 100000
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def make_subtitle(name, lines=400):
+    blocks = []
+    for i in range(lines):
+        start, end = i * 3, i * 3 + 2
+        blocks.append(f"{i + 1}\n00:{start // 60 % 60:02d}:{start % 60:02d},000 --> 00:{end // 60 % 60:02d}:"
+                      f"{end % 60:02d},500\n{name} line {i + 1} - සිංහල උපසිරැසි\n")
+    return '\n'.join(blocks).encode('utf-8')
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_7z(files):
+    buffer = io.BytesIO()
+    with py7zr.SevenZipFile(buffer, 'w') as archive:
+        for name, data in files.items():
+            archive.writestr(data, name)
+    return buffer.getvalue()
+
+
+def _rar_block(head_type, flags, body):
+    # RAR 4.x block: CRC16 (low half of the CRC32 of everything after it), type, flags, size, body
+    header = struct.pack('<BHH', head_type, flags, 7 + len(body)) + body
+    return struct.pack('<H', zlib.crc32(header) & 0xffff) + header
+
+
+def make_rar(files):
+    # Nothing on a disconnected box can create RAR archives, so this writes a RAR 4.x archive by hand. Members are
+    # stored uncompressed, which rarfile reads without the unrar tool.
+    parts = [b'Rar!\x1a\x07\x00', _rar_block(0x73, 0, struct.pack('<HI', 0, 0))]
+    for name, data in files.items():
+        encoded = name.encode()
+        # pack size, unpacked size, host OS (Unix), CRC32, DOS time, version 2.0, method "store", name size, mode
+        body = struct.pack('<IIBIIBBHI', len(data), len(data), 3, zlib.crc32(data), 0x21000000, 20, 0x30,
+                           len(encoded), 0o100644) + encoded
+        # 0x8000: the block is followed by `pack size` bytes of data
+        parts.append(_rar_block(0x74, 0x8000, body) + data)
+    parts.append(_rar_block(0x7b, 0x4000, b''))
+    return b''.join(parts)
+
+
+def make_archives():
+    files = {'Subtitle.si.srt': make_subtitle('Subtitle'), 'Subtitle.si.ass': make_subtitle('Styled', 200),
+             'readme.txt': b'Downloaded from baiscope.lk\n'}
+    return {'zip': make_zip(files), 'rar': make_rar(files), '7z': make_7z(files)}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    # `server` carries latency (seconds), base_url and the shared state, see serve()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', content_type='text/html; charset=UTF-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, data, status=200):
+        self.reply(status, json.dumps(data), 'application/json')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def count(self, name):
+        with self.server.lock:
+            self.server.requests[name] = self.server.requests.get(name, 0) + 1
+
+
+class Baiscope(StandIn):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if 'tmstv' in params:
+            self.count('archive')
+            kind = list(ARCHIVE_TYPES)[int(params['tmstv'][0]) % len(ARCHIVE_TYPES)]
+            # No file name in the URL, the bot goes by the Content-Type like it does for the real site
+            return self.reply(200, self.server.archives[kind], ARCHIVE_TYPES[kind])
+        if 's' in params:
+            self.count('search')
+            match = re.match(r'^/page/(\d+)/?$', url.path)
+            return self.reply(200, self.search_page(params['s'][0], int(match.group(1)) if match else 1))
+        if url.path.strip('/'):
+            self.count('post')
+            return self.reply(200, self.post_page(url.path))
+        self.reply(404, 'Not found')
+
+    def search_page(self, query, page):
+        series = next((name for name in SERIES if name.lower() == query.lower()), None)
+        if series is None:
+            text = self.server.fixtures['search_movies.html']
+        else:
+            # Every result page of a series search is one season of it
+            text = self.server.fixtures['search_series.html'].replace('Loki', series)
+            text = text.replace('/loki-', f"/{series.lower().replace(' ', '-')}-")
+            text = text.replace('S02 : E', f'S{page:02d} : E').replace('-s02-e', f'-s{page:02d}-e')
+        return text.replace(RECORDED_HOST, self.server.base_url)
+
+    def post_page(self, path):
+        # Each post links to its own archive, the archive type follows from the id
+        archive_id = zlib.crc32(path.encode()) % 1000000
+        text = self.server.fixtures['post.html'].replace('/?tmstv=7777', f'/?tmstv={archive_id}')
+        return text.replace(RECORDED_HOST, self.server.base_url)
+
+
+class Tmdb(StandIn):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query).get('query', [''])[0]
+        if url.path.endswith('/search/movie'):
+            self.count('search/movie')
+            title = next((name for name in MOVIES if name.lower() == query.lower()), None)
+            results = [] if title is None else [{'id': title_id(title), 'title': title, 'release_date': '2023-07-19',
+                                                 'overview': f'{title} overview.', 'poster_path': '/poster.jpg'}]
+            return self.reply_json({'page': 1, 'results': results})
+        if url.path.endswith('/search/tv'):
+            self.count('search/tv')
+            name = next((name for name in SERIES if name.lower() == query.lower()), None)
+            results = [] if name is None else [{'id': title_id(name), 'name': name, 'first_air_date': '2021-06-09',
+                                                'overview': f'{name} overview.', 'poster_path': '/poster.jpg'}]
+            return self.reply_json({'page': 1, 'results': results})
+        match = re.search(r'/tv/(\d+)$', url.path)
+        if match:
+            self.count('tv')
+            name = next((name for name in SERIES if title_id(name) == int(match.group(1))), None)
+            if name is None:
+                return self.reply_json({'success': False, 'status_code': 34}, 404)
+            return self.reply_json({'id': title_id(name), 'name': name, 'first_air_date': '2021-06-09',
+                                    'overview': f'{name} overview.', 'poster_path': '/poster.jpg'})
+        self.reply_json({'success': False}, 404)
+
+
+class Telegram(StandIn):
+    def do_GET(self):
+        self.handle_method()
+
+    def do_POST(self):
+        self.handle_method()
+
+    def handle_method(self):
+        body = self.read_body()
+        time.sleep(self.server.latency)
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+        self.count(method)
+        with self.server.lock:
+            self.server.message_id += 1
+            message_id = self.server.message_id
+        # telebot sends the parameters in the query string, files as multipart
+        chat_id = int(parse_qs(urlparse(self.path).query).get('chat_id', ['1'])[0])
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                   'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}, 'text': ''}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'benchmark_bot'}
+        elif method == 'sendDocument':
+            # Uploads and re-sends by file_id both get a document back, like the real API
+            file_id = f'file-{zlib.crc32(body) & 0xffffffff:08x}'
+            result = dict(message, document={'file_id': file_id, 'file_unique_id': file_id})
+        elif method in ('answerInlineQuery', 'answerCallbackQuery', 'deleteMessage'):
+            result = True
+        else:
+            result = message
+        self.reply_json({'ok': True, 'result': result})
+
+
+def serve(handler, latency, state=None):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.lock = threading.Lock()
+    server.requests = {}
+    server.message_id = 0
+    for name, value in (state or {}).items():
+        setattr(server, name, value)
+    return server
+
+
+def run(latencies, ports, stop):
+    # Entry point of the stand-in process: starts the three servers, reports their ports and serves until `stop`
+    # is set. Request counts are sent back through `ports` once stopped.
+    fixtures = {name: load_fixture(name) for name in ('search_series.html', 'search_movies.html', 'post.html')}
+    servers = {
+        'baiscope': serve(Baiscope, latencies['baiscope'], {'fixtures': fixtures, 'archives': make_archives()}),
+        'tmdb': serve(Tmdb, latencies['tmdb']),
+        'telegram': serve(Telegram, latencies['telegram']),
+    }
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    ports.put({name: server.base_url for name, server in servers.items()})
+    stop.wait()
+    for server in servers.values():
+        server.shutdown()
+    ports.put({name: server.requests for name, server in servers.items()})
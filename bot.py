@@ -1,23 +1,34 @@
 import requests
-from bs4 import BeautifulSoup
-import zipfile
-import os
 import telebot
-from urllib.parse import quote_plus
 import re
 from telebot import types
 import datetime
+import time
 from config import config, logging
 from connectors import database
 from helpers.fetch_series import fetch_series
 from helpers.fetch_series_names import fetch_series_names
-from helpers.zip_helper import download_extract_zip
+from helpers.search_crawler import fetch_search_page
+from helpers import tmdb, telegram_files, season_bundle, inline_search, series_refresh, prewarm
+from helpers import downloads, metrics, rate_limit, subtitle_store, disk_quota
 from config.logging import logger
 
-bot = telebot.TeleBot(config.TOKEN)
+if config.TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = config.TELEGRAM_API_URL + '/bot{0}/{1}'
+bot = rate_limit.ThrottledTeleBot(config.TOKEN)
 logging.set_bot(bot)
 database.create_table_movie()
 database.create_table_tv()
+database.create_table_tmdb_cache()
+database.create_table_telegram_files()
+database.create_table_title_requests()
+database.create_table_subtitle_store()
+database.migrate()
+subtitle_store.import_legacy()
+# The quota may have been lowered since the last run
+disk_quota.enforce()
+tmdb.purge_cache()
+metrics.register('telegram_log', lambda: dict(logging.shipper.stats))
 
 
 @bot.message_handler(commands=['start'])
@@ -65,10 +76,24 @@ def send_help(message):
         logger.error(f"An error occurred: {e}")
 
 
+# Registered before the /s_ handler, whose regexp would match /stats too
+@bot.message_handler(commands=['stats'])
+def send_stats(message):
+    try:
+        if message.from_user.id not in config.ADMIN_IDS:
+            logger.info(f"Ignoring /stats from non-admin user {message.from_user.id}")
+            return
+        bot.reply_to(message, f"```\n{metrics.format_stats()}\n```", parse_mode='Markdown')
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+
+
 @bot.message_handler(commands=['movie'])
+@metrics.timed('handler.movie')
 def search_movie(message):
     try:
         logger.info("Received a request to search for a movie.")
+        prewarm.mark_interactive()
         msg = bot.send_message(message.chat.id, "🔍 Searching....")
         # Check if the command is exactly '/movie'
         if message.text.strip() == '/movie':
@@ -81,30 +106,30 @@ def search_movie(message):
         movie_name = message.text.split('/movie ', 1)[1].strip()
 
         # Search for the movie on the website
-        search_url = f'{config.HOST_URL}/?s={quote_plus(movie_name)}'
-        r = requests.get(search_url)
-        soup = BeautifulSoup(r.text, 'html.parser')
+        page = fetch_search_page(config.HOST_URL, movie_name, 1)
 
         # Find all movie titles and links
-        movies = []
-        for h2 in soup.find_all('h2', class_='entry-title'):
-            if len(movies) >= 5:  # Stop after finding 5 movies
-                logger.info("Found 5 movies. Breaking the loop.")
-                break
-            a = h2.find('a', href=True)
-            text = a.text
+        candidates = []
+        for post in page.posts:
+            text = post.title
             match = re.search(r'\(\d{4}\)', text)
             if match:
-                # This is a movie, add it to the list
+                # This is a movie, add it to the candidates
                 title = text[:match.end()].strip()
                 search_title = title.split(' (')[0].strip()
-                link = a['href']
-
-                # get the movie details
-                tmdb_url = f'https://api.themoviedb.org/3/search/movie?api_key={config.TMDB_API_KEY}&query={search_title}'
-                tmdb_response = requests.get(tmdb_url).json()
+                link = post.link
+                candidates.append((title, search_title, link))
 
-                if tmdb_response['results']:
+        # Get the movie details, only looking up as many candidates as we still need to reach 5 movies
+        # All the batches share one TMDB_DEADLINE, a slow TMDB can't hold the reply up batch after batch
+        movies = []
+        deadline = tmdb.new_deadline()
+        while candidates and len(movies) < 5 and time.monotonic() < deadline:
+            batch = candidates[:5 - len(movies)]
+            candidates = candidates[len(batch):]
+            tmdb_responses = tmdb.search_movies([search_title for title, search_title, link in batch], deadline)
+            for (title, search_title, link), tmdb_response in zip(batch, tmdb_responses):
+                if tmdb_response and tmdb_response['results']:
                     movie_data = tmdb_response['results'][0]
                     movies.append((title, link, movie_data))
                     logger.info(f"Added movie to the list: {title}")
@@ -131,20 +156,22 @@ def search_movie(message):
         logger.info("Sending the message with the found movies.")
         bot.edit_message_text(movie_message, msg.chat.id, msg.message_id, parse_mode='Markdown')
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.message_handler(regexp='^/dl')
+@metrics.timed('handler.dl')
 def download_subtitle(message):
     try:
         logger.info("Received a request to download subtitles.")
         movie_id = message.text.split('/dl_', 1)[1].strip()
+        prewarm.note_request('movie', movie_id)
         result = database.get_link(movie_id)
         if result is None:
             logger.error("Invalid command. No link found for the provided movie ID.")
             bot.reply_to(message, "This command is incorrect. Please provide a valid command.")
             return
-        chat_dir = f'subtitles/movies/{movie_id}'
         movie_message = ""
         movie_message += f"🎬 *{result[1]}* ({result[2]})\n\n"
         movie_message += f"{result[4]}\n\n"
@@ -152,39 +179,39 @@ def download_subtitle(message):
                        caption=movie_message, parse_mode='Markdown')
         msg = bot.send_message(message.chat.id, "⏫ Uploading the subtitles...")
 
-        # check if directory exists
-        if os.path.isdir(chat_dir):
-            logger.info("Directory exists. Sending all .srt files.")
-            # Send all .srt files
-            for file in os.listdir(chat_dir):
-                if file.endswith('.srt'):
-                    with open(os.path.join(chat_dir, file), 'rb') as f:
-                        bot.send_document(message.chat.id, f)
+        # check if we already have the subtitles
+        files = subtitle_store.files('movie', movie_id)
+        if files:
+            logger.info("Subtitles are in the store. Sending them.")
+            for name, path in files:
+                telegram_files.send_document(bot, message.chat.id, path, name)
             bot.edit_message_text(f"✅ {result[1]} ({result[2]}) Subtitle Uploaded", msg.chat.id, msg.message_id,
                                   parse_mode='Markdown')
         else:
-            logger.info("Directory does not exist. Creating directory and downloading subtitles.")
+            logger.info("Subtitles are not in the store (never downloaded or evicted). Downloading them.")
             bot.edit_message_text("⏳ Almost Done...", msg.chat.id, msg.message_id, parse_mode='Markdown')
 
-            # Create a unique directory for this chat
-            os.makedirs(chat_dir, exist_ok=True)
-
-            download_extract_zip(result[0], chat_dir, bot, msg)
-            # Send all .srt files
-            for file in os.listdir(chat_dir):
-                if file.endswith(('.srt', '.ass', '.ssa', '.vtt', '.stl', '.scc', '.ttml', '.sbv', '.idx', '.sub')):
-                    with open(os.path.join(chat_dir, file), 'rb') as f:
-                        bot.send_document(message.chat.id, f)
+            # Shares the download with anyone else asking for this movie right now
+            if not downloads.download_movie(movie_id, result[0], downloads.ProgressMessage(bot, msg).update):
+                bot.edit_message_text("😰 Couldn't download the subtitles. Please try again later.", msg.chat.id,
+                                      msg.message_id, parse_mode='Markdown')
+                return
+            # Send all the subtitle files
+            for name, path in subtitle_store.files('movie', movie_id):
+                telegram_files.send_document(bot, message.chat.id, path, name)
             bot.edit_message_text(f"✅ {result[1]} ({result[2]}) Subtitle Uploaded", msg.chat.id, msg.message_id,
                                   parse_mode='Markdown')
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.message_handler(commands=['tv'])
+@metrics.timed('handler.tv')
 def search_tv(message):
     try:
         logger.info("Received a request to search for a TV series.")
+        prewarm.mark_interactive()
         msg = bot.send_message(message.chat.id, "🔍 Searching for the tv series...")
         # Check if the command is exactly '/tv'
         if message.text.strip() == '/tv':
@@ -212,12 +239,10 @@ def search_tv(message):
 
             tv_message = ""
 
-            for name in series_names:
-                # Get series details from TMDB
-                tmdb_url = f'https://api.themoviedb.org/3/search/tv?api_key={config.TMDB_API_KEY}&query={quote_plus(name)}'
-                tmdb_response = requests.get(tmdb_url).json()
-
-                if tmdb_response['results']:
+            # Get series details from TMDB
+            tmdb_responses = tmdb.search_tvs(series_names)
+            for tmdb_response in tmdb_responses:
+                if tmdb_response and tmdb_response['results']:
                     series_data = tmdb_response['results'][0]
                     series_id = series_data['id']
 
@@ -232,93 +257,103 @@ def search_tv(message):
         else:
             bot.edit_message_text("found", msg.chat.id, msg.message_id, parse_mode='Markdown')
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.message_handler(regexp='^/s')
+@metrics.timed('handler.s')
 def download_subtitle(message):
     try:
         logger.info("Received a request to download subtitles.")
         msg = bot.send_message(message.chat.id, "🔍 Searching for the subtitles...")
         series_id = message.text.split('/s_', 1)[1].strip()
         logger.info(f"Series ID: {series_id}")
-        tmdb_url = f'https://api.themoviedb.org/3/tv/{series_id}?api_key={config.TMDB_API_KEY}'
-        response = requests.get(tmdb_url)
-        if response.status_code == 200:
-            logger.info("Successfully retrieved series information from TMDB.")
-            tmdb_response = response.json()
-            series_name = tmdb_response['name']
-            year = re.search(r'\d{4}', tmdb_response['first_air_date']).group()
-            overview = tmdb_response['overview']
-            poster_path = tmdb_response['poster_path']
-            results = database.check_series_available(series_id)
-            current_datetime = datetime.datetime.now().strftime('%Y-%m-%d')
-            if results and current_datetime[:10] == results[0][6]:
+        prewarm.note_request('series', series_id)
+        try:
+            tmdb_response = tmdb.get_tv(series_id)
+        except requests.RequestException as e:
+            logger.error(f"An error occurred while trying to retrieve the series information: {e}")
+            bot.send_message(message.chat.id, "Something went wrong. Please try again later.")
+            return
+        if tmdb_response is None:
+            logger.error("Could not find a series with the provided ID.")
+            bot.send_message(message.chat.id, "I'm sorry, but I couldn't find a series with that ID.")
+            return
+        logger.info("Successfully retrieved series information from TMDB.")
+        series_name = tmdb_response['name']
+        year = re.search(r'\d{4}', tmdb_response['first_air_date']).group()
+        overview = tmdb_response['overview']
+        poster_path = tmdb_response['poster_path']
+        results = database.check_series_available(series_id)
+        current_datetime = datetime.datetime.now().strftime('%Y-%m-%d')
+        if results:
+            if current_datetime[:10] == results[0][6]:
                 logger.info("Series is available in the database & its up to date")
-                row = []
-                tv_message = ""
-                # Create a message with a keyboard of seasons
-                seasons = sorted(set(season for series_name, year, season, episode, link, overview, updated in results))
-                keyboard = types.InlineKeyboardMarkup()
-                tv_message += f"🎬 *{results[0][0]}* ({results[0][1]})\n\n"
-                tv_message += f"{results[0][5]}\n\n"
-                tv_message += f"Please select a season:"
-                for season in seasons:
-                    button = types.InlineKeyboardButton(text=f"Season {season}",
-                                                        callback_data=f"series_{series_id}_season_{season}")
-                    row.append(button)
-                    if len(row) == 3:
-                        keyboard.row(*row)
-                        row = []
-                if row:
+            else:
+                # Serve what we have straight away and look for new episodes in the background
+                logger.info("Series is available in the database but not up to date. Refreshing in the background.")
+                series_refresh.refresh_in_background(config.HOST_URL, series_name, series_id, year, overview,
+                                                     poster_path)
+            row = []
+            tv_message = ""
+            # Create a message with a keyboard of seasons
+            seasons = sorted(set(season for series_name, year, season, episode, link, overview, updated in results))
+            keyboard = types.InlineKeyboardMarkup()
+            tv_message += f"🎬 *{results[0][0]}* ({results[0][1]})\n\n"
+            tv_message += f"{results[0][5]}\n\n"
+            tv_message += f"Please select a season:"
+            for season in seasons:
+                button = types.InlineKeyboardButton(text=f"Season {season}",
+                                                    callback_data=f"series_{series_id}_season_{season}")
+                row.append(button)
+                if len(row) == 3:
                     keyboard.row(*row)
-                bot.send_photo(msg.chat.id, f"https://image.tmdb.org/t/p/original{tmdb_response['poster_path']}",
-                               caption=tv_message, reply_markup=keyboard, parse_mode='Markdown')
-                bot.delete_message(msg.chat.id, msg.message_id, timeout=None)
+                    row = []
+            if row:
+                keyboard.row(*row)
+            bot.send_photo(msg.chat.id, f"https://image.tmdb.org/t/p/original{tmdb_response['poster_path']}",
+                           caption=tv_message, reply_markup=keyboard, parse_mode='Markdown')
+            bot.delete_message(msg.chat.id, msg.message_id, timeout=None)
 
-            else:
-                logger.info("Series is not available in the database or not uptodate. Fetching series.")
-                series = fetch_series(config.HOST_URL, series_name, series_id, year, overview, poster_path)
+        else:
+            logger.info("Series is not available in the database. Fetching series.")
+            series = fetch_series(config.HOST_URL, series_name, series_id, year, overview, poster_path)
 
-                if not series:
-                    bot.edit_message_text("I'm sorry, but I couldn't find any series matching your search.",
-                                          msg.chat.id,
-                                          msg.message_id)
-                    return
+            if not series:
+                bot.edit_message_text("I'm sorry, but I couldn't find any series matching your search.",
+                                      msg.chat.id,
+                                      msg.message_id)
+                return
 
-                row = []
-                tv_message = ""
-                # Create a message with a keyboard of seasons
-                seasons = sorted(set(season for title, season, episode, link in series))
-                keyboard = types.InlineKeyboardMarkup()
-                tv_message += f"🎬 *{series_name}* ({year})\n\n"
-                tv_message += f"{overview}\n\n"
-                tv_message += f"Please select a season:"
-                for season in seasons:
-                    button = types.InlineKeyboardButton(text=f"Season {season}",
-                                                        callback_data=f"series_{series_id}_season_{season}")
-                    row.append(button)
-                    if len(row) == 3:
-                        keyboard.row(*row)
-                        row = []
-                if row:
+            row = []
+            tv_message = ""
+            # Create a message with a keyboard of seasons
+            seasons = sorted(set(season for title, season, episode, link in series))
+            keyboard = types.InlineKeyboardMarkup()
+            tv_message += f"🎬 *{series_name}* ({year})\n\n"
+            tv_message += f"{overview}\n\n"
+            tv_message += f"Please select a season:"
+            for season in seasons:
+                button = types.InlineKeyboardButton(text=f"Season {season}",
+                                                    callback_data=f"series_{series_id}_season_{season}")
+                row.append(button)
+                if len(row) == 3:
                     keyboard.row(*row)
+                    row = []
+            if row:
+                keyboard.row(*row)
 
-                bot.send_photo(msg.chat.id, f"https://image.tmdb.org/t/p/original{poster_path}",
-                               caption=tv_message, reply_markup=keyboard, parse_mode='Markdown')
-                bot.delete_message(msg.chat.id, msg.message_id, timeout=None)
-
-        elif response.status_code == 404:
-            logger.error("Could not find a series with the provided ID.")
-            bot.send_message(message.chat.id, "I'm sorry, but I couldn't find a series with that ID.")
-        else:
-            logger.error("An error occurred while trying to retrieve the series information.")
-            bot.send_message(message.chat.id, "Something went wrong. Please try again later.")
+            bot.send_photo(msg.chat.id, f"https://image.tmdb.org/t/p/original{poster_path}",
+                           caption=tv_message, reply_markup=keyboard, parse_mode='Markdown')
+            bot.delete_message(msg.chat.id, msg.message_id, timeout=None)
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('series_'))
+@metrics.timed('handler.season')
 def handle_season_button(call):
     try:
         # Extract the series ID and season number from the callback data
@@ -327,30 +362,20 @@ def handle_season_button(call):
         season = int(season)
 
         logger.info(f"Handling season button for series_id {series_id} and season {season}")
+        prewarm.mark_interactive()
         msg = bot.send_message(call.message.chat.id, "🔍 Searching for the subtitles...")
 
-        # Define the directory of the season
-        season_dir = f'subtitles/series/{series_id}/{season}'
-
         # Retrieve the episode numbers and links from the database
         episodes = database.get_series_links(series_id, season)
-        # Check if the season directory exists
-        if not os.path.isdir(season_dir):
-            # Download all subtitles and save them
-            for season, episode, link, updated, series_name in episodes:
-                chat_dir = f'subtitles/series/{series_id}/{season}/{episode}'
-                os.makedirs(chat_dir, exist_ok=True)
-
-                # download & extract zip
-                download_extract_zip(link, chat_dir, bot, msg)
-        else:
-            logger.info(f"Subtitles for series_id {series_id} and season {season} already exist")
+        # Download the episodes we don't have yet, this also picks up episodes added since the season was downloaded
+        failed = downloads.download_season(series_id, season, episodes, downloads.ProgressMessage(bot, msg).update)
         # Create a message with a keyboard of episodes
+        available = {episode for episode, name, path in subtitle_store.season_files(series_id, season)}
         keyboard = types.InlineKeyboardMarkup()
         row = []
         for season, episode, link, updated, series_name in episodes:
             # Check if subtitles exist for the episode
-            subtitle_exists = os.path.isdir(f'subtitles/series/{series_id}/{season}/{episode}')
+            subtitle_exists = episode in available
             # Add a check or uncheck emoji based on whether subtitles exist
             episode_text = f"✅ E{episode}" if subtitle_exists else f"❌ E{episode}"
             callback_data = f"episode_{episode}_season_{season}_series_id_{series_id}"
@@ -365,14 +390,18 @@ def handle_season_button(call):
                                                          callback_data=f"zip_{series_id}_season_{season}")
         keyboard.row(download_all_button)
         message_season = f"*Download {episodes[0][4]} : Season {season}*\n _(Last updated: {episodes[0][3]})_"
+        if failed:
+            message_season += f"\n _(Couldn't download {len(failed)} episode(s), please try again later)_"
         bot.edit_message_text(message_season, msg.chat.id, msg.message_id, reply_markup=keyboard, parse_mode='Markdown')
 
         logger.info(f"Sent message for series_id {series_id} and season {season}")
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('episode_'))
+@metrics.timed('handler.episode')
 def download_subtitle(call):
     try:
         # Extract the series ID, season number, and episode number from the callback data
@@ -382,26 +411,32 @@ def download_subtitle(call):
         episode = int(episode)
 
         logger.info(f"Uploading subtitles for series_id {series_id}, season {season}, episode {episode}")
+        prewarm.note_request('series', series_id)
 
         msg = bot.send_message(call.message.chat.id, "⏫ Uploading the subtitles...")
         name = database.get_series_name(series_id)
-        exists = f'subtitles/series/{series_id}/{season}/{episode}'
-        # check if directory exists
-        if os.path.isdir(exists):
-            for file in os.listdir(exists):
-                if file.endswith(('.srt', '.ass', '.ssa', '.vtt', '.stl', '.scc', '.ttml', '.sbv', '.idx', '.sub')):
-                    with open(os.path.join(exists, file), 'rb') as f:
-                        bot.send_document(call.message.chat.id, f)
+        files = subtitle_store.files('series', series_id, season, episode)
+        if not files:
+            # Never downloaded, or evicted from the store to stay under the disk quota
+            link = next((row[2] for row in database.get_series_links(series_id, season) if row[1] == episode), None)
+            if link is not None and downloads.download_episode(series_id, season, episode, link):
+                files = subtitle_store.files('series', series_id, season, episode)
+        # check if we have the subtitles
+        if files:
+            for file_name, path in files:
+                telegram_files.send_document(bot, call.message.chat.id, path, file_name)
             bot.edit_message_text(f"✅ {name} S{season}:E{episode} Subtitle Uploaded", msg.chat.id, msg.message_id,
                                   parse_mode='Markdown')
         else:
             bot.reply_to(call.message, "The subtitles for this episode are not available. Please try another episode.")
             logger.error(f"Subtitles not found for series_id {series_id}, season {season}, episode {episode}")
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('zip_'))
+@metrics.timed('handler.zip')
 def zip_download(call):
     try:
         # Extract the series ID and season number from the callback data
@@ -410,77 +445,59 @@ def zip_download(call):
         season = int(season)
 
         logger.info(f"Downloading & Compressing subtitles for series_id {series_id} and season {season}")
+        prewarm.mark_interactive()
 
         msg = bot.send_message(call.message.chat.id, "🗜️ Compressing the subtitles...")
 
         # Get the series name from the database
         series_name = database.get_series_name(series_id)
 
-        # Define the directory of the season
-        season_dir = f'subtitles/series/{series_id}/{season}'
-
-        # Define the zip file name
-        zip_file_name = os.path.join(season_dir, f'{series_name} - Season {season}.zip')
-
-        # Check if the zip file already exists
-        if not os.path.exists(zip_file_name):
-            # Create a ZipFile object in write mode
-            with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                # Walk the directory tree and add files to the ZipFile object
-                for root, dirs, files in os.walk(season_dir):
-                    for file in files:
-                        # Skip .zip files
-                        if not file.endswith('.zip'):
-                            file_path = os.path.join(root, file)
-                            zipf.write(file_path, arcname=os.path.relpath(file_path, start=season_dir))
+        # Download the episodes that aren't in the store (anymore), then bring the season zip up to date. It's usually
+        # already built in the background when the episodes landed.
+        downloads.download_season(series_id, season, database.get_series_links(series_id, season),
+                                  downloads.ProgressMessage(bot, msg).update)
+        zip_file_name = season_bundle.build_bundle(series_id, season, series_name)
 
         # Send the zip file to the user
-        with open(zip_file_name, 'rb') as zipf:
-            bot.send_document(call.message.chat.id, zipf)
+        telegram_files.send_document(bot, call.message.chat.id, zip_file_name)
         bot.edit_message_text(f'✅ {series_name} - Season {season} zip file uploaded', msg.chat.id, msg.message_id,
                               parse_mode='Markdown')
 
         logger.info(f'Sent zip file for series_id {series_id} and season {season}')
     except Exception as e:
+        metrics.mark_error()
         logger.error(f"An error occurred: {e}")
 
 
 @bot.inline_handler(lambda query: len(query.query) > 0)
+@metrics.timed('handler.inline')
 def query_text(inline_query):
     try:
-        # Find series names that match the query
-        series_rows = database.find_series_name_search(inline_query)
-
-        # Find movie names that match the query
-        movie_rows = database.find_movie_name_search(inline_query)
+        prewarm.mark_interactive()
+        # Find series and movie names that match the query, one page at a time
+        rows, next_offset = inline_search.page(inline_query.query, inline_query.offset)
         # Create an InlineQueryResultArticle for each matching row
         results = []
-        for i, row in enumerate(series_rows):
-            r = types.InlineQueryResultArticle(
-                id=str(i),
-                thumbnail_url=f"https://image.tmdb.org/t/p/original{row[3]}",
-                title=row[0] + ' ' + '(' + row[2] + ') [Tv]',
-                description=row[4],
-                input_message_content=types.InputTextMessageContent(
-                    message_text="/s_" + row[1]
-                )
-            )
-            results.append(r)
-
-        for i, row in enumerate(movie_rows):
+        for kind, row in rows:
+            if kind == 'tv':
+                title = row[0] + ' ' + '(' + row[2] + ') [Tv]'
+                message_text = "/s_" + row[1]
+            else:
+                title = row[0] + ' ' + '(' + row[2] + ') [Movie]'
+                message_text = "/dl_" + row[1]
             r = types.InlineQueryResultArticle(
-                id=str(i),
+                id=f"{kind}_{row[1]}",
                 thumbnail_url=f"https://image.tmdb.org/t/p/original{row[3]}",
-                title=row[0] + ' ' + '(' + row[2] + ') [Movie]',
+                title=title,
                 description=row[4],
                 input_message_content=types.InputTextMessageContent(
-                    message_text="/dl_" + row[1]
+                    message_text=message_text
                 )
             )
             results.append(r)
 
         # If no results were found, add a custom message
-        if not results:
+        if not results and not inline_query.offset:
             r = types.InlineQueryResultArticle(
                 id='no_results',
                 title='No results, Try /tv or /movie commands',
@@ -491,9 +508,14 @@ def query_text(inline_query):
             results.append(r)
 
         # Send the results
-        bot.answer_inline_query(inline_query.id, results)
+        bot.answer_inline_query(inline_query.id, results, cache_time=config.INLINE_CACHE_TIME, is_personal=False,
+                                next_offset=next_offset)
     except Exception as e:
+        metrics.mark_error()
         print(e)
 
 
-bot.polling()
+if __name__ == '__main__':
+    metrics.start_server()
+    prewarm.start(bot)
+    bot.polling()
@@ -7,4 +7,96 @@ TOKEN = os.getenv('TOKEN')
 TMDB_API_KEY = os.getenv('TMDB_API_KEY')
 HOST_URL = os.getenv('HOST_URL')
 LOG_CHANNEL_ID = os.getenv('LOG_CHANNEL_ID')
+# Only needed to point the bot at other API servers, e.g. a local Bot API server or the benchmark stand-ins
+TMDB_API_URL = os.getenv('TMDB_API_URL') or 'https://api.themoviedb.org/3'
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 
+# Telegram log shipping
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE') or 15)
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL') or 10)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE') or 1000)
+
+# Rate limits, in requests per second
+TMDB_RATE = float(os.getenv('TMDB_RATE') or 40)
+TMDB_BURST = int(os.getenv('TMDB_BURST') or 20)
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE') or 25)
+TELEGRAM_BURST = int(os.getenv('TELEGRAM_BURST') or 25)
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE') or 1)
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST') or 10)
+TELEGRAM_RETRIES = int(os.getenv('TELEGRAM_RETRIES') or 3)
+
+# Metrics
+METRICS_LISTEN = os.getenv('METRICS_LISTEN') or '127.0.0.1'
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+# Telegram user ids allowed to use /stats, comma separated
+ADMIN_IDS = {int(user_id) for user_id in (os.getenv('ADMIN_IDS') or '').split(',') if user_id.strip()}
+
+# TMDB lookups
+TMDB_WORKERS = int(os.getenv('TMDB_WORKERS') or 5)
+TMDB_TIMEOUT = float(os.getenv('TMDB_TIMEOUT') or 5)
+TMDB_DEADLINE = float(os.getenv('TMDB_DEADLINE') or 8)
+TMDB_CACHE_SIZE = int(os.getenv('TMDB_CACHE_SIZE') or 1000)
+TMDB_MEMORY_TTL = int(os.getenv('TMDB_MEMORY_TTL') or 3600)
+TMDB_CACHE_TTL = int(os.getenv('TMDB_CACHE_TTL') or 7 * 24 * 3600)
+TMDB_NEGATIVE_TTL = int(os.getenv('TMDB_NEGATIVE_TTL') or 3600)
+
+# Outbound HTTP
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT') or 5)
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT') or 30)
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES') or 2)
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF') or 0.5)
+HTTP_MAX_BACKOFF = float(os.getenv('HTTP_MAX_BACKOFF') or 10)
+HTTP_MAX_PER_HOST = int(os.getenv('HTTP_MAX_PER_HOST') or 8)
+HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS') or 10)
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE') or 16)
+
+# Search page crawling
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS') or 8)
+SEARCH_WINDOW = int(os.getenv('SEARCH_WINDOW') or 4)
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE') or 500)
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL') or 120)
+SEARCH_CACHE_MAX_AGE = int(os.getenv('SEARCH_CACHE_MAX_AGE') or 3600)
+
+# Season downloads
+SEASON_WORKERS = int(os.getenv('SEASON_WORKERS') or 6)
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL') or 2)
+
+# Archive downloads
+MAX_ARCHIVE_SIZE = int(os.getenv('MAX_ARCHIVE_SIZE') or 50 * 1024 * 1024)
+MAX_SUBTITLE_SIZE = int(os.getenv('MAX_SUBTITLE_SIZE') or 5 * 1024 * 1024)
+MAX_EXTRACTED_SIZE = int(os.getenv('MAX_EXTRACTED_SIZE') or 50 * 1024 * 1024)
+
+# Disk quota of subtitles/, the least recently used season zips and subtitles are evicted above it (0 means no limit)
+SUBTITLE_QUOTA = int(os.getenv('SUBTITLE_QUOTA') or 1024 * 1024 * 1024)
+
+# SQLite
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT') or 30)
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB') or 20000)
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE') or 256 * 1024 * 1024)
+
+# Inline search
+INLINE_SEARCH_LIMIT = int(os.getenv('INLINE_SEARCH_LIMIT') or 200)
+INLINE_CACHE_SIZE = int(os.getenv('INLINE_CACHE_SIZE') or 2000)
+INLINE_CACHE_TTL = int(os.getenv('INLINE_CACHE_TTL') or 60)
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME') or 300)
+
+# Background series refreshes
+REFRESH_WORKERS = int(os.getenv('REFRESH_WORKERS') or 2)
+
+# Pre-warming popular titles
+PREWARM_INTERVAL = int(os.getenv('PREWARM_INTERVAL') or 1800)
+PREWARM_WINDOW = int(os.getenv('PREWARM_WINDOW') or 7 * 24 * 3600)
+PREWARM_TOP = int(os.getenv('PREWARM_TOP') or 20)
+PREWARM_CONCURRENCY = int(os.getenv('PREWARM_CONCURRENCY') or 2)
+PREWARM_BANDWIDTH = int(os.getenv('PREWARM_BANDWIDTH') or 200 * 1024 * 1024)
+PREWARM_IDLE_SECONDS = float(os.getenv('PREWARM_IDLE_SECONDS') or 10)
+PREWARM_CHAT_ID = os.getenv('PREWARM_CHAT_ID')
+
+# Webhook mode (webhook.py)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN') or '0.0.0.0'
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8443)
+WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY') or 16)
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE') or 256)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS') or 40)
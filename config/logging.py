@@ -1,12 +1,16 @@
+import atexit
 import logging
 import os
+import queue
+import threading
+import time
 from config import config
+from helpers import rate_limit
 
 chat_id = config.LOG_CHANNEL_ID
 
 # Initialize the bot variable
 bot = None
-log_buffer = []
 
 # Create the logs directory if it doesn't exist
 if not os.path.exists('logs'):
@@ -24,33 +28,119 @@ handler.setLevel(logging.INFO)
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.INFO)
 
+# Errors of the Telegram shipper itself only go to the file and the terminal, logging them to Telegram could loop
+shipper_logger = logging.getLogger(__name__ + '.telegram')
+shipper_logger.propagate = False
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+_STOP = object()
+
 
 # Function to set the bot
 def set_bot(bot_object):
     global bot
     bot = bot_object
-
-
-# Function to send logs to your Telegram channel
-def telegram_log(message):
-    global log_buffer
-    if os.getenv('TELEGRAM_LOGGING') == 'TRUE':
-        log_buffer.append(message)
-        if len(log_buffer) >= 15:
+    shipper.start()
+
+
+class TelegramShipper:
+    # Sends the queued log lines to the log channel from a background thread, so a slow Telegram API never holds up
+    # the thread that logged. Lines are batched into one message until there are LOG_BATCH_SIZE of them, the message
+    # would get too long, or the oldest line has waited LOG_FLUSH_INTERVAL seconds.
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'sent': 0, 'dropped': 0, 'failed': 0}
+        self.thread = None
+
+    def put(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            # Backpressure: drop rather than block the caller, the next message says how many were lost
+            self.stats['dropped'] += 1
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='telegram-log', daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5):
+        # Flush what is still queued, called at exit
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def _run(self):
+        # Log batches wait behind user replies for Telegram's rate limit
+        with rate_limit.background():
+            self._ship()
+
+    def _ship(self):
+        lines = []
+        length = 0
+        first_at = None
+        reported_drops = 0
+        while True:
+            timeout = None if first_at is None else max(0, first_at + config.LOG_FLUSH_INTERVAL - time.monotonic())
             try:
-                # Send the messages in the buffer to your Telegram channel
-                bot.send_message(chat_id=chat_id, text='\n'.join(log_buffer))
-                # Clear the buffer
-                log_buffer = []
-            except Exception as e:
-                logger.error(f"An error occurred: {e}")
+                line = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                line = None
+            if line is _STOP:
+                self._send(lines)
+                return
+            if line is not None:
+                dropped = self.stats['dropped']
+                if dropped > reported_drops:
+                    line = f"({dropped - reported_drops} log line(s) dropped)\n{line}"
+                    reported_drops = dropped
+                line = line[:MAX_MESSAGE_LENGTH]
+                if lines and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                    self._send(lines)
+                    lines, length, first_at = [], 0, None
+                lines.append(line)
+                length += len(line) + 1
+                first_at = first_at or time.monotonic()
+            if lines and (len(lines) >= config.LOG_BATCH_SIZE
+                          or time.monotonic() - first_at >= config.LOG_FLUSH_INTERVAL):
+                self._send(lines)
+                lines, length, first_at = [], 0, None
+
+    def _send(self, lines):
+        if not lines:
+            return
+        if bot is None:
+            self.stats['dropped'] += len(lines)
+            return
+        try:
+            # Send the messages in the buffer to your Telegram channel
+            bot.send_message(chat_id=chat_id, text='\n'.join(lines))
+            self.stats['sent'] += len(lines)
+        except Exception as e:
+            self.stats['failed'] += len(lines)
+            shipper_logger.error(f"An error occurred: {e}")
+
+
+shipper = TelegramShipper(config.LOG_QUEUE_SIZE)
+atexit.register(shipper.stop)
 
 
 # Create a custom handler
 class TelegramHandler(logging.Handler):
+    # Only formats the record and queues it, the shipper thread does the sending
     def emit(self, record):
-        log_entry = self.format(record)
-        telegram_log(log_entry)
+        if os.getenv('TELEGRAM_LOGGING') != 'TRUE':
+            return
+        try:
+            shipper.put(self.format(record))
+        except Exception:
+            self.handleError(record)
 
 
 # Set the custom handler
@@ -66,3 +156,5 @@ telegram_handler.setFormatter(formatter)  # use the same formatter for the teleg
 # Add the handlers to the logger
 logger.addHandler(handler)
 logger.addHandler(stream_handler)  # add the stream handler to the logger
+shipper_logger.addHandler(handler)
+shipper_logger.addHandler(stream_handler)
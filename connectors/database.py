@@ -1,144 +1,426 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
+from config import config
+from helpers import metrics
+
+DB_PATH = 'connectors/movie_details.db'
+
+# Each thread keeps one connection open for its whole life instead of connecting for every query. That also lets
+# sqlite3 reuse its prepared statements, which are cached per connection.
+local = threading.local()
 
 
 def connect_db():
-    return sqlite3.connect('connectors/movie_details.db')
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        # isolation_level=None leaves transactions to us, see transaction()
+        conn = sqlite3.connect(DB_PATH, timeout=config.DB_BUSY_TIMEOUT, isolation_level=None,
+                               cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{config.DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={config.DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        local.conn = conn
+    return conn
 
 
-def create_table_movie():
+@contextmanager
+def transaction():
     conn = connect_db()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS movie_details
-    (movie_id text UNIQUE, movie_name text, year text, baiscope_link text, overview text, poster text)''')
-    conn.commit()
-    conn.close()
+    if conn.in_transaction:
+        # Already inside a transaction scope, join it
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
 
 
-def create_table_tv():
+def timed(func):
+    # Query latency goes to the sqlite.<function> stage of helpers/metrics.py
+    return metrics.timed(f'sqlite.{func.__name__}')(func)
+
+
+# Trigram tokenizing needs SQLite 3.34, older versions fall back to prefix matching on words
+FTS_TOKENIZER = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+
+
+def _create_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS tv_details_series_season ON tv_details (series_id, season)")
+    conn.execute("CREATE INDEX IF NOT EXISTS tv_details_series_name ON tv_details (series_name)")
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS series_search USING fts5(series_id UNINDEXED, series_name, "
+                 f"tokenize='{FTS_TOKENIZER}')")
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(movie_id UNINDEXED, movie_name, "
+                 f"tokenize='{FTS_TOKENIZER}')")
+    # Build the search index from what is already in the database
+    conn.execute("INSERT INTO series_search SELECT DISTINCT series_id, series_name FROM tv_details")
+    conn.execute("INSERT INTO movie_search SELECT movie_id, movie_name FROM movie_details")
+
+
+def _track_blob_use(conn):
+    # When each subtitle blob was last sent or downloaded, the disk quota evicts the least recently used first
+    conn.execute("ALTER TABLE subtitle_blobs ADD COLUMN last_used real")
+    conn.execute("UPDATE subtitle_blobs SET last_used = created_at")
+    conn.execute("CREATE INDEX IF NOT EXISTS subtitle_blobs_last_used ON subtitle_blobs (last_used)")
+    conn.execute("CREATE INDEX IF NOT EXISTS title_files_content_hash ON title_files (content_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive_files_content_hash ON archive_files (content_hash)")
+
+
+# Each migration runs once, in order, PRAGMA user_version records how many have been applied
+MIGRATIONS = [_create_indexes, _track_blob_use]
+
+
+def migrate():
     conn = connect_db()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS tv_details (series_id text, series_name text, year text, season integer, 
-    episode integer, baiscope_link text UNIQUE, overview text, updated text, poster text)''')
-    conn.commit()
-    conn.close()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS, start=1):
+        if version < target:
+            with transaction():
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+
+
+def _index_series_name(conn, series_id, series_name):
+    # A series can be posted under slightly different names, index each of them once. Call this before inserting
+    # the episode, tv_details tells us (through its series_name index) whether the name is new.
+    c = conn.execute("SELECT 1 FROM tv_details WHERE series_name = ? AND series_id = ? LIMIT 1",
+                     (series_name, series_id))
+    if c.fetchone() is None:
+        conn.execute("INSERT INTO series_search VALUES (?,?)", (str(series_id), series_name))
+
+
+def create_table_movie():
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS movie_details
+        (movie_id text UNIQUE, movie_name text, year text, baiscope_link text, overview text, poster text)''')
+
+
+def create_table_tv():
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS tv_details (series_id text, series_name text, year text,
+        season integer, episode integer, baiscope_link text UNIQUE, overview text, updated text, poster text)''')
 
 
+@timed
 def insert_details(movie_id, movie_name, year, baiscope_link, overview, poster):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO movie_details VALUES (?,?,?,?,?,?)",
-              (movie_id, movie_name, year, baiscope_link, overview, poster))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        c = conn.execute("INSERT OR IGNORE INTO movie_details VALUES (?,?,?,?,?,?)",
+                         (movie_id, movie_name, year, baiscope_link, overview, poster))
+        if c.rowcount:
+            # FTS5 columns have no type affinity, store the id as text like the details tables do
+            conn.execute("INSERT INTO movie_search VALUES (?,?)", (str(movie_id), movie_name))
 
 
+@timed
 def get_link(movie_id):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT baiscope_link, movie_name, year, poster, overview FROM movie_details WHERE movie_id = ?", (movie_id,))
-    result = c.fetchone()
-    conn.close()
-    return result
+    c = connect_db().execute("SELECT baiscope_link, movie_name, year, poster, overview FROM movie_details "
+                             "WHERE movie_id = ?", (movie_id,))
+    return c.fetchone()
 
 
-def insert_tv_details(series_id, series_name, year, season, episode, baiscope_link, overview, updated, poster):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO tv_details VALUES (?,?,?,?,?,?,?,?,?)",
-              (series_id, series_name, year, season, episode, baiscope_link, overview, updated, poster))
-    conn.commit()
-    conn.close()
+@timed
+def upsert_tv_details(rows, updated):
+    # Writes a whole scraped batch of (series_id, series_name, year, season, episode, baiscope_link, overview, poster)
+    # rows in one transaction. Rows that are already stored as is aren't rewritten, only their updated date moves.
+    with transaction() as conn:
+        for series_id, series_name in {(row[0], row[1]) for row in rows}:
+            _index_series_name(conn, series_id, series_name)
+        c = conn.executemany("""
+                INSERT INTO tv_details VALUES (?,?,?,?,?,?,?,?,?)
+                ON CONFLICT (baiscope_link) DO UPDATE SET
+                    series_id = excluded.series_id, series_name = excluded.series_name, year = excluded.year,
+                    season = excluded.season, episode = excluded.episode, overview = excluded.overview,
+                    updated = excluded.updated, poster = excluded.poster
+                WHERE series_id IS NOT excluded.series_id OR series_name IS NOT excluded.series_name
+                    OR year IS NOT excluded.year OR season IS NOT excluded.season OR episode IS NOT excluded.episode
+                    OR overview IS NOT excluded.overview OR poster IS NOT excluded.poster
+            """, [(series_id, series_name, year, season, episode, link, overview, updated, poster)
+                  for series_id, series_name, year, season, episode, link, overview, poster in rows])
+        changed = c.rowcount
+        for series_id in {row[0] for row in rows}:
+            touch_series(series_id, updated)
+    return changed
+
+
+@timed
+def touch_series(series_id, updated):
+    # Marks every episode of the series as checked on `updated` with one statement
+    with transaction() as conn:
+        conn.execute("UPDATE tv_details SET updated = ? WHERE series_id = ? AND updated IS NOT ?",
+                     (updated, series_id, updated))
+
 
+@timed
+def get_series_link_set(series_id):
+    c = connect_db().execute("SELECT baiscope_link FROM tv_details WHERE series_id = ?", (series_id,))
+    return {row[0] for row in c.fetchall()}
 
+
+@timed
 def get_series_links(series_id, season):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT episode, baiscope_link, updated, series_name FROM tv_details WHERE series_id = ? AND season = ?",
-              (series_id, season))
+    c = connect_db().execute("SELECT episode, baiscope_link, updated, series_name FROM tv_details "
+                             "WHERE series_id = ? AND season = ?", (series_id, season))
     rows = c.fetchall()
-    if rows is None:
-        conn.close()
-        return None
-    else:
-        return sorted([(season, row[0], row[1], row[2], row[3]) for row in rows], key=lambda x: x[1])
+    return sorted([(season, row[0], row[1], row[2], row[3]) for row in rows], key=lambda x: x[1])
 
 
+@timed
 def get_series_name(series_id):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT series_name FROM tv_details WHERE series_id = ? ", (series_id,))
+    c = connect_db().execute("SELECT series_name FROM tv_details WHERE series_id = ? ", (series_id,))
     result = c.fetchone()
-    if result is None:
-        conn.close()
-        return None
-    else:
-        series_name = result[0]
-        conn.close()
-        return series_name
+    return result[0] if result else None
 
 
+@timed
 def check_series_available(series_id):
-    conn = connect_db()
-    c = conn.cursor()
     # Execute a SELECT statement to check if the series_id exists
-    c.execute("SELECT series_name, year, season, episode, baiscope_link, overview, updated FROM tv_details WHERE "
-              "series_id = ?",
-              (series_id,))
-    result = c.fetchall()
-    conn.close()
-    return result
+    c = connect_db().execute("SELECT series_name, year, season, episode, baiscope_link, overview, updated "
+                             "FROM tv_details WHERE series_id = ?", (series_id,))
+    return c.fetchall()
 
 
+@timed
 def fetch_old_data(series_id):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT series_name, year, season, episode, baiscope_link, overview, updated FROM tv_details WHERE "
-              "series_id = ?",
-              (series_id,))
-    result = c.fetchall()
-    conn.close()
-    return result
+    c = connect_db().execute("SELECT series_name, year, season, episode, baiscope_link, overview, updated "
+                             "FROM tv_details WHERE series_id = ?", (series_id,))
+    return c.fetchall()
 
 
+@timed
 def search_tv_series(series_name):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT series_id FROM tv_details WHERE series_name = ?", (series_name,))
+    c = connect_db().execute("SELECT series_id FROM tv_details WHERE series_name = ?", (series_name,))
     result = c.fetchone()
-    if result is None:
-        conn.close()
-        return None
-    else:
-        series_id = result[0]
-        conn.close()
-        return series_id
+    return result[0] if result else None
 
 
-def find_series_name_search(name):
+def _search_query(query):
+    # Turns what the user typed into an FTS5 query, or None when the index can't answer it
+    if FTS_TOKENIZER == 'trigram':
+        # Trigrams match any substring of at least 3 characters, like the LIKE '%q%' search did
+        if len(query) < 3:
+            return None
+        return '"' + query.replace('"', '""') + '"'
+    tokens = [token for token in query.replace('"', ' ').split() if token]
+    return ' '.join(f'"{token}"*' for token in tokens) or None
+
+
+def _find(search_table, id_column, name_column, details_sql, query, limit):
     conn = connect_db()
-    c = conn.cursor()
-    c.execute("""
+    match = _search_query(query)
+    if match is None:
+        # Too short for the index, but the search table only has one row per title so scanning it is cheap
+        c = conn.execute(f"SELECT {id_column}, 0 AS rank FROM {search_table} WHERE {name_column} LIKE ? "
+                         f"GROUP BY {id_column} ORDER BY {id_column} LIMIT ?", ('%' + query + '%', limit))
+    else:
+        c = conn.execute(f"SELECT {id_column}, min(rank) AS rank FROM {search_table} WHERE {search_table} MATCH ? "
+                         f"GROUP BY {id_column} ORDER BY rank LIMIT ?", (match, limit))
+    # Rows indexed before the ids were stored as text may still hold integers
+    ids = [str(row[0]) for row in c.fetchall()]
+    if not ids:
+        return []
+    placeholders = ','.join('?' * len(ids))
+    rows = {str(row[1]): row for row in conn.execute(details_sql.format(placeholders=placeholders), ids).fetchall()}
+    # Keep the relevance order of the search
+    return [rows[id] for id in ids if id in rows]
+
+
+@timed
+def find_series_name_search(query, limit=50):
+    return _find('series_search', 'series_id', 'series_name', """
                 SELECT series_name, series_id, year, poster, overview
-                FROM tv_details 
-                WHERE series_name LIKE ? 
-                GROUP BY series_id 
-                ORDER BY series_id
-            """, ('%' + name.query + '%',))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+                FROM tv_details
+                WHERE series_id IN ({placeholders})
+                GROUP BY series_id
+            """, query.strip(), limit)
 
 
-def find_movie_name_search(name):
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("""
+@timed
+def find_movie_name_search(query, limit=50):
+    return _find('movie_search', 'movie_id', 'movie_name', """
                 SELECT movie_name, movie_id, year, poster, overview
-                FROM movie_details 
-                WHERE movie_name LIKE ? 
-                GROUP BY movie_id 
-                ORDER BY movie_id
-            """, ('%' + name.query + '%',))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+                FROM movie_details
+                WHERE movie_id IN ({placeholders})
+            """, query.strip(), limit)
+
+
+def create_table_tmdb_cache():
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS tmdb_cache (cache_key text PRIMARY KEY, response text,
+        expires_at real)''')
+
+
+@timed
+def get_tmdb_cache(cache_key):
+    c = connect_db().execute("SELECT response, expires_at FROM tmdb_cache WHERE cache_key = ?", (cache_key,))
+    return c.fetchone()
+
+
+@timed
+def set_tmdb_cache(cache_key, response, expires_at):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO tmdb_cache VALUES (?,?,?)", (cache_key, response, expires_at))
+
+
+@timed
+def purge_tmdb_cache(now):
+    with transaction() as conn:
+        conn.execute("DELETE FROM tmdb_cache WHERE expires_at < ?", (now,))
+
+
+def create_table_telegram_files():
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS telegram_files (content_hash text PRIMARY KEY, path text,
+        file_id text)''')
+
+
+@timed
+def get_file_id(content_hash):
+    c = connect_db().execute("SELECT file_id FROM telegram_files WHERE content_hash = ?", (content_hash,))
+    result = c.fetchone()
+    return result[0] if result else None
+
+
+@timed
+def set_file_id(content_hash, path, file_id):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO telegram_files VALUES (?,?,?)", (content_hash, path, file_id))
+
+
+@timed
+def delete_file_id(content_hash):
+    with transaction() as conn:
+        conn.execute("DELETE FROM telegram_files WHERE content_hash = ?", (content_hash,))
+
+
+def create_table_title_requests():
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS title_requests (kind text, title_id text, requested_at real)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS title_requests_requested_at ON title_requests (requested_at)")
+
+
+@timed
+def record_request(kind, title_id, requested_at):
+    with transaction() as conn:
+        conn.execute("INSERT INTO title_requests VALUES (?,?,?)", (kind, title_id, requested_at))
+
+
+@timed
+def get_popular_titles(since, limit):
+    c = connect_db().execute("""
+                SELECT kind, title_id, COUNT(*) AS requests
+                FROM title_requests
+                WHERE requested_at >= ?
+                GROUP BY kind, title_id
+                ORDER BY requests DESC
+                LIMIT ?
+            """, (since, limit))
+    return c.fetchall()
+
+
+@timed
+def purge_title_requests(before):
+    with transaction() as conn:
+        conn.execute("DELETE FROM title_requests WHERE requested_at < ?", (before,))
+
+
+def create_table_subtitle_store():
+    with transaction() as conn:
+        # Every subtitle file is stored once under its content hash, see helpers/subtitle_store.py
+        conn.execute('''CREATE TABLE IF NOT EXISTS subtitle_blobs (content_hash text PRIMARY KEY, size integer,
+        created_at real)''')
+        # Which files a movie (season and episode 0) or an episode has
+        conn.execute('''CREATE TABLE IF NOT EXISTS title_files (kind text, title_id text, season integer,
+        episode integer, name text, content_hash text, PRIMARY KEY (kind, title_id, season, episode, name))''')
+        # Which files a post or archive URL gave us, so it never has to be fetched again
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive_files (url text, name text, content_hash text,
+        PRIMARY KEY (url, name))''')
+
+
+@timed
+def add_blob(content_hash, size, created_at):
+    with transaction() as conn:
+        # Adding a blob we already have counts as using it
+        conn.execute("INSERT INTO subtitle_blobs (content_hash, size, created_at, last_used) VALUES (?,?,?,?) "
+                     "ON CONFLICT (content_hash) DO UPDATE SET last_used = excluded.last_used",
+                     (content_hash, size, created_at, created_at))
+
+
+@timed
+def touch_blobs(hashes, last_used):
+    with transaction() as conn:
+        conn.executemany("UPDATE subtitle_blobs SET last_used = ? WHERE content_hash = ?",
+                         [(last_used, content_hash) for content_hash in hashes])
+
+
+@timed
+def get_blobs_usage():
+    # (number of blobs, total size in bytes)
+    c = connect_db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM subtitle_blobs")
+    return c.fetchone()
+
+
+@timed
+def get_cold_blobs(used_before, limit):
+    c = connect_db().execute("SELECT content_hash, size FROM subtitle_blobs WHERE last_used < ? "
+                             "ORDER BY last_used LIMIT ?", (used_before, limit))
+    return c.fetchall()
+
+
+@timed
+def delete_blobs(hashes):
+    # Forgets the blobs along with every movie, episode and archive that had one of them, those are fetched again
+    # as a whole next time. Returns the (kind, title_id, season, episode) entries that were dropped.
+    placeholders = ','.join('?' * len(hashes))
+    with transaction() as conn:
+        entries = conn.execute(f"SELECT DISTINCT kind, title_id, season, episode FROM title_files "
+                               f"WHERE content_hash IN ({placeholders})", hashes).fetchall()
+        conn.executemany("DELETE FROM title_files WHERE kind = ? AND title_id = ? AND season = ? AND episode = ?",
+                         entries)
+        conn.execute(f"DELETE FROM archive_files WHERE url IN (SELECT url FROM archive_files "
+                     f"WHERE content_hash IN ({placeholders}))", hashes)
+        conn.execute(f"DELETE FROM subtitle_blobs WHERE content_hash IN ({placeholders})", hashes)
+    return entries
+
+
+@timed
+def set_title_files(kind, title_id, season, episode, files):
+    with transaction() as conn:
+        conn.execute("DELETE FROM title_files WHERE kind = ? AND title_id = ? AND season = ? AND episode = ?",
+                     (kind, title_id, season, episode))
+        conn.executemany("INSERT INTO title_files VALUES (?,?,?,?,?,?)",
+                         [(kind, title_id, season, episode, name, content_hash) for name, content_hash in files])
+
+
+@timed
+def get_title_files(kind, title_id, season, episode):
+    c = connect_db().execute("SELECT name, content_hash FROM title_files WHERE kind = ? AND title_id = ? AND "
+                             "season = ? AND episode = ? ORDER BY name", (kind, title_id, season, episode))
+    return c.fetchall()
+
+
+@timed
+def get_season_files(series_id, season):
+    c = connect_db().execute("SELECT episode, name, content_hash FROM title_files WHERE kind = 'series' AND "
+                             "title_id = ? AND season = ? ORDER BY episode, name", (series_id, season))
+    return c.fetchall()
+
+
+@timed
+def set_archive_files(url, files):
+    with transaction() as conn:
+        conn.execute("DELETE FROM archive_files WHERE url = ?", (url,))
+        conn.executemany("INSERT INTO archive_files VALUES (?,?,?)",
+                         [(url, name, content_hash) for name, content_hash in files])
+
+
+@timed
+def get_archive_files(url):
+    c = connect_db().execute("SELECT name, content_hash FROM archive_files WHERE url = ? ORDER BY name", (url,))
+    return c.fetchall()
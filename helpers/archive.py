@@ -0,0 +1,113 @@
+import os
+import zipfile
+import rarfile
+import py7zr
+import logging
+from config import config
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+SUBTITLE_EXTENSIONS = ('.srt', '.ass', '.ssa', '.vtt', '.stl', '.scc', '.ttml', '.sbv', '.idx', '.sub')
+
+# Everything the backends raise for a broken archive
+BAD_ARCHIVE_ERRORS = (zipfile.BadZipFile, rarfile.Error, py7zr.exceptions.ArchiveError)
+
+
+class ArchiveLimitExceeded(Exception):
+    pass
+
+
+def is_subtitle(name):
+    return name.lower().endswith(SUBTITLE_EXTENSIONS)
+
+
+class _ZipBackend:
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, 'r')
+
+    def members(self):
+        return [(info.filename, info.file_size) for info in self.archive.infolist() if not info.is_dir()]
+
+    def read(self, names):
+        for name in names:
+            with self.archive.open(name) as f:
+                yield name, f
+
+    def close(self):
+        self.archive.close()
+
+
+class _RarBackend(_ZipBackend):
+    def __init__(self, path):
+        self.archive = rarfile.RarFile(path, 'r')
+
+
+class _SevenZipBackend:
+    def __init__(self, path):
+        self.archive = py7zr.SevenZipFile(path, mode='r')
+
+    def members(self):
+        return [(info.filename, info.uncompressed) for info in self.archive.list() if not info.is_directory]
+
+    def read(self, names):
+        # py7zr decompresses the selected members in one pass, the rest of the archive is skipped
+        for name, f in (self.archive.read(targets=list(names)) or {}).items():
+            yield name, f
+
+    def close(self):
+        self.archive.close()
+
+
+BACKENDS = {'.zip': _ZipBackend, '.rar': _RarBackend, '.7z': _SevenZipBackend}
+
+
+def _unique_path(target_dir, name):
+    # Archives often have the same file name in several folders, keep all of them once flattened
+    base, ext = os.path.splitext(name)
+    path = os.path.join(target_dir, name)
+    n = 2
+    while os.path.exists(path):
+        path = os.path.join(target_dir, f'{base} ({n}){ext}')
+        n += 1
+    return path
+
+
+def _copy_limited(src, dst, limit):
+    # Declared sizes can lie, so count what is actually written
+    size = 0
+    while True:
+        chunk = src.read(64 * 1024)
+        if not chunk:
+            return size
+        size += len(chunk)
+        if size > limit:
+            raise ArchiveLimitExceeded(f"member is over the {limit} bytes limit")
+        dst.write(chunk)
+
+
+@metrics.timed('archive.extract')
+def extract_subtitles(archive_path, target_dir):
+    # Writes only the subtitle members of the archive straight into target_dir, flattened, and returns their paths.
+    # Members and the archive as a whole are checked against the size limits to guard against zip bombs.
+    backend = BACKENDS[os.path.splitext(archive_path)[1].lower()](archive_path)
+    try:
+        members = [(name, size) for name, size in backend.members() if is_subtitle(name)]
+        for name, size in members:
+            if size > config.MAX_SUBTITLE_SIZE:
+                raise ArchiveLimitExceeded(f"{name} is {size} bytes, over the {config.MAX_SUBTITLE_SIZE} limit")
+        total = sum(size for name, size in members)
+        if total > config.MAX_EXTRACTED_SIZE:
+            raise ArchiveLimitExceeded(f"subtitles are {total} bytes, over the {config.MAX_EXTRACTED_SIZE} limit")
+        logger.info(f"Extracting {len(members)} subtitle file(s) from {archive_path}")
+
+        extracted = []
+        written = 0
+        for name, src in backend.read(name for name, size in members):
+            path = _unique_path(target_dir, os.path.basename(name.replace('\\', '/')))
+            with open(path, 'wb') as dst:
+                extracted.append(path)
+                written += _copy_limited(src, dst, min(config.MAX_SUBTITLE_SIZE, config.MAX_EXTRACTED_SIZE - written))
+        return extracted
+    finally:
+        backend.close()
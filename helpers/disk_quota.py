@@ -0,0 +1,143 @@
+import os
+import shutil
+import threading
+import time
+import logging
+from config import config
+from connectors import database
+from helpers import metrics, season_bundle, subtitle_store
+
+logger = logging.getLogger(__name__)
+
+# Keeps the subtitles/ tree under SUBTITLE_QUOTA bytes. Everything in it counts: the blobs of the store, the season
+# zips and the archives being extracted. Over the quota, leftover extraction directories go first, then the least
+# recently used season zips (they can be rebuilt from the blobs), then the least recently used blobs. A movie,
+# episode or archive that loses a blob is forgotten as a whole, so the handlers download it again on the next
+# request instead of reporting it missing. Season zips of the affected seasons are removed too.
+
+# Evict down to this share of the quota, so we don't evict again on every download
+LOW_WATERMARK = 0.9
+# Blobs and zips used this recently are never evicted, a handler may be about to send them
+GRACE_SECONDS = 300
+# Extraction directories older than this were left behind by a crash
+STALE_STAGING_SECONDS = 3600
+BATCH_SIZE = 100
+
+lock = threading.Lock()
+stats = {'runs': 0, 'evicted_blobs': 0, 'evicted_bytes': 0, 'evicted_titles': 0, 'evicted_bundles': 0}
+
+
+def _dir_size(directory):
+    # (total size, newest mtime) of the files under directory
+    size, mtime = 0, 0.0
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def _bundles():
+    # [(last used, size, series_id, season)] of the season zips, least recently used first
+    bundles = []
+    for series_id, season, directory in season_bundle.season_dirs():
+        size, mtime = _dir_size(directory)
+        bundles.append((mtime, size, series_id, season))
+    return sorted(bundles)
+
+
+def _staging():
+    # [(last modified, size, directory)] of the extraction directories
+    if not os.path.isdir(subtitle_store.STAGING_DIR):
+        return []
+    result = []
+    for name in os.listdir(subtitle_store.STAGING_DIR):
+        directory = os.path.join(subtitle_store.STAGING_DIR, name)
+        size, mtime = _dir_size(directory)
+        result.append((max(mtime, os.path.getmtime(directory)), size, directory))
+    return result
+
+
+def usage():
+    blobs, blob_bytes = database.get_blobs_usage()
+    bundle_bytes = sum(size for mtime, size, series_id, season in _bundles())
+    staging_bytes = sum(size for mtime, size, directory in _staging())
+    return {'blobs': blobs, 'blob_bytes': blob_bytes, 'bundle_bytes': bundle_bytes, 'staging_bytes': staging_bytes,
+            'bytes': blob_bytes + bundle_bytes + staging_bytes, 'quota': config.SUBTITLE_QUOTA, **stats}
+
+
+def _remove_bundles(entries):
+    # Returns the bytes freed
+    freed = 0
+    for series_id, season in {(title_id, season) for kind, title_id, season, episode in entries if kind == 'series'}:
+        freed += _dir_size(os.path.join(season_bundle.BUNDLE_DIR, str(series_id), str(season)))[0]
+        season_bundle.remove_bundle(series_id, season)
+    return freed
+
+
+def _evict(blobs):
+    entries = database.delete_blobs([content_hash for content_hash, size in blobs])
+    for content_hash, size in blobs:
+        try:
+            os.remove(subtitle_store.blob_path(content_hash))
+        except FileNotFoundError:
+            pass
+    bundle_bytes = _remove_bundles(entries)
+    stats['evicted_blobs'] += len(blobs)
+    stats['evicted_bytes'] += sum(size for content_hash, size in blobs) + bundle_bytes
+    stats['evicted_titles'] += len(entries)
+    # The zips removed along with the blobs were counted against the quota too
+    return bundle_bytes
+
+
+def enforce():
+    # Cheap when the store is under the quota, called after every download. Returns the number of bytes freed.
+    if not config.SUBTITLE_QUOTA:
+        return 0
+    with lock:
+        blobs, size = database.get_blobs_usage()
+        bundles = _bundles()
+        staging = _staging()
+        size += sum(bundle[1] for bundle in bundles) + sum(entry[1] for entry in staging)
+        if size <= config.SUBTITLE_QUOTA:
+            return 0
+        stats['runs'] += 1
+        target = config.SUBTITLE_QUOTA * LOW_WATERMARK
+        freed = 0
+        with metrics.timer('disk_quota.evict'):
+            now = time.time()
+            for mtime, entry_size, directory in staging:
+                if mtime < now - STALE_STAGING_SECONDS:
+                    shutil.rmtree(directory, ignore_errors=True)
+                    freed += entry_size
+            for mtime, bundle_size, series_id, season in bundles:
+                if size - freed <= target or mtime >= now - GRACE_SECONDS:
+                    break
+                season_bundle.remove_bundle(series_id, season)
+                stats['evicted_bundles'] += 1
+                stats['evicted_bytes'] += bundle_size
+                freed += bundle_size
+            while size - freed > target:
+                cold = database.get_cold_blobs(time.time() - GRACE_SECONDS, BATCH_SIZE)
+                if not cold:
+                    logger.error(f"Subtitle store is over its quota ({size - freed} of {config.SUBTITLE_QUOTA} "
+                                 f"bytes) but everything in it was used in the last {GRACE_SECONDS}s")
+                    break
+                # Only as many as it takes to get under the low watermark
+                batch = []
+                for content_hash, blob_size in cold:
+                    if size - freed <= target:
+                        break
+                    batch.append((content_hash, blob_size))
+                    freed += blob_size
+                freed += _evict(batch)
+        logger.info(f"Evicted {freed} bytes from the subtitle store, {size - freed} of {config.SUBTITLE_QUOTA} "
+                    f"bytes used")
+        return freed
+
+
+metrics.register('subtitle_store', usage)
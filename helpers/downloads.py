@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+from config import config
+from helpers import disk_quota, season_bundle, subtitle_store
+from helpers.single_flight import SingleFlight
+from helpers.zip_helper import download_extract_zip, find_archive_url
+
+logger = logging.getLogger(__name__)
+
+# Shared by every season download, so a few big seasons at once can't flood baiscope
+executor = ThreadPoolExecutor(max_workers=config.SEASON_WORKERS, thread_name_prefix='season')
+
+# Downloads are keyed by movie, episode and season, so users asking for the same title at the same time share one
+# download instead of racing each other
+flights = SingleFlight()
+
+class ProgressMessage:
+    # Edits a single Telegram message, at most once every `interval` seconds, skipping edits that change nothing
+
+    def __init__(self, bot, msg, interval=None):
+        self.bot = bot
+        self.msg = msg
+        self.interval = config.PROGRESS_INTERVAL if interval is None else interval
+        self.last_text = None
+        self.last_edit = 0
+        self.lock = threading.Lock()
+
+    def update(self, text, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if text == self.last_text or (not force and now - self.last_edit < self.interval):
+                return
+            try:
+                self.bot.edit_message_text(text, self.msg.chat.id, self.msg.message_id, parse_mode='Markdown')
+                self.last_text = text
+                self.last_edit = now
+            except Exception as e:
+                logger.error(f"Failed to update the progress message: {e}")
+
+
+def fetch_subtitles(link):
+    # [(name, hash)] of the subtitles behind a baiscope post. Neither the post nor its archive is fetched again once
+    # it is in the store, and a post linking to an archive we already have only costs the post page.
+    cached = subtitle_store.archive_files(link)
+    if cached:
+        return cached
+    zip_url = find_archive_url(link)
+    if zip_url is None:
+        logger.error(f"No download link found on {link}")
+        return []
+    files = subtitle_store.archive_files(zip_url)
+    if files:
+        logger.info(f"Archive {zip_url} is already in the store")
+    else:
+        os.makedirs(subtitle_store.STAGING_DIR, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=subtitle_store.STAGING_DIR)
+        try:
+            if not download_extract_zip(link, staging, None, None, zip_url=zip_url):
+                return []
+            files = subtitle_store.ingest(staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        if not files:
+            logger.error(f"No subtitles found in {link}")
+            return []
+        subtitle_store.record_archive(zip_url, files)
+        disk_quota.enforce()
+    subtitle_store.record_archive(link, files)
+    return files
+
+
+def _download_title(kind, title_id, season, episode, link):
+    if subtitle_store.has_files(kind, title_id, season, episode):
+        return True
+    files = fetch_subtitles(link)
+    if files:
+        subtitle_store.link(kind, title_id, season, episode, files)
+    return bool(files)
+
+
+def download_movie(movie_id, link, progress=None):
+    # Returns whether the subtitles of the movie are available
+    return flights.do(('movie', str(movie_id)), lambda report: _download_title('movie', movie_id, 0, 0, link),
+                      progress)
+
+
+def download_episode(series_id, season, episode, link):
+    return flights.do(('episode', str(series_id), int(season), int(episode)),
+                      lambda report: _download_title('series', series_id, season, episode, link))
+
+
+def _download_season(series_id, season, episodes, report):
+    available = {episode for episode, name, path in subtitle_store.season_files(series_id, season)}
+    missing = [row for row in episodes if row[1] not in available]
+    if not missing:
+        logger.info(f"Subtitles for series_id {series_id} and season {season} already exist")
+        return []
+
+    total = len(missing)
+    futures = {executor.submit(download_episode, series_id, season, episode, link): episode
+               for season, episode, link, updated, series_name in missing}
+    done = 0
+    failed = []
+    for future in as_completed(futures):
+        episode = futures[future]
+        done += 1
+        try:
+            if not future.result():
+                failed.append(episode)
+        except Exception as e:
+            logger.error(f"Failed to download episode {episode} of series_id {series_id}: {e}")
+            failed.append(episode)
+        report(f"⏬ Downloading the subtitles... ({done}/{total})", done == total)
+
+    if failed:
+        logger.error(f"Failed to download episodes {sorted(failed)} of series_id {series_id}")
+    if len(failed) < total:
+        season_bundle.schedule_build(series_id, season, episodes[0][4])
+    return sorted(failed)
+
+
+def download_season(series_id, season, episodes, progress=None):
+    # Downloads the episodes of the season that aren't in the store yet on the shared pool and returns the episodes
+    # that failed. Episodes that did download are kept even if others fail.
+    return flights.do(('season', str(series_id), int(season)),
+                      lambda report: _download_season(series_id, season, episodes, report), progress)
@@ -0,0 +1,150 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+import random
+import threading
+import time
+import logging
+from config import config
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt, anything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# One session for the whole bot, so connections are pooled per host and kept alive between requests
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=config.HTTP_POOL_HOSTS, pool_maxsize=config.HTTP_POOL_SIZE)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+host_semaphores = {}
+host_metrics = {}
+lock = threading.Lock()
+
+
+def _semaphore(host):
+    with lock:
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(config.HTTP_MAX_PER_HOST)
+        return host_semaphores[host]
+
+
+def _release_on_close(r, semaphore):
+    # A streamed body is read after get() returns, so the host's slot is only given back once the response is closed
+    close = r.close
+    released = False
+
+    def close_and_release():
+        nonlocal released
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                semaphore.release()
+
+    r.close = close_and_release
+
+
+def _send(host, url, timeout, kwargs):
+    semaphore = _semaphore(host)
+    semaphore.acquire()
+    try:
+        r = session.get(url, timeout=timeout, **kwargs)
+    except BaseException:
+        semaphore.release()
+        raise
+    if kwargs.get('stream'):
+        _release_on_close(r, semaphore)
+    else:
+        semaphore.release()
+    return r
+
+
+def _host_metrics(host):
+    # Callers hold the lock
+    if host not in host_metrics:
+        host_metrics[host] = {'requests': 0, 'errors': 0, 'retries': 0, 'total_time': 0.0, 'max_time': 0.0,
+                              'downloads': 0, 'download_bytes': 0, 'download_time': 0.0}
+    return host_metrics[host]
+
+
+def _record(host, elapsed, error=False, retry=False):
+    metrics.observe(f'http.{host}', elapsed, error)
+    with lock:
+        host_stats = _host_metrics(host)
+        host_stats['requests'] += 1
+        host_stats['total_time'] += elapsed
+        host_stats['max_time'] = max(host_stats['max_time'], elapsed)
+        if error:
+            host_stats['errors'] += 1
+        if retry:
+            host_stats['retries'] += 1
+
+
+def record_download(host, size, elapsed):
+    with lock:
+        host_stats = _host_metrics(host)
+        host_stats['downloads'] += 1
+        host_stats['download_bytes'] += size
+        host_stats['download_time'] += elapsed
+
+
+def get_metrics():
+    with lock:
+        result = {}
+        for host, host_stats in host_metrics.items():
+            result[host] = dict(host_stats, avg_time=host_stats['total_time'] / max(host_stats['requests'], 1))
+            if host_stats['download_time']:
+                result[host]['bytes_per_sec'] = host_stats['download_bytes'] / host_stats['download_time']
+        return result
+
+
+metrics.register('http', get_metrics)
+
+
+def _backoff(attempt, retry_after=None):
+    # Exponential backoff with full jitter, unless the server told us how long to wait
+    if retry_after is not None and retry_after.isdigit():
+        delay = min(int(retry_after), config.HTTP_MAX_BACKOFF)
+    else:
+        delay = random.uniform(0, min(config.HTTP_MAX_BACKOFF, config.HTTP_BACKOFF * 2 ** attempt))
+    time.sleep(delay)
+
+
+def get(url, timeout=None, bucket=None, **kwargs):
+    # `bucket` is an optional rate_limit.TokenBucket every attempt takes a token from, a 429 with Retry-After pauses it.
+    # A stream=True response holds one of the host's HTTP_MAX_PER_HOST slots until it is closed, use it in a `with`.
+    host = urlparse(url).netloc
+    if timeout is None:
+        timeout = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT)
+    attempts = config.HTTP_RETRIES + 1
+
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        if bucket is not None:
+            bucket.acquire()
+        start = time.monotonic()
+        try:
+            r = _send(host, url, timeout, kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record(host, time.monotonic() - start, error=True, retry=not last_attempt)
+            if last_attempt:
+                raise
+            logger.info(f"Request to {host} failed ({e}), retrying")
+            _backoff(attempt)
+            continue
+
+        retry = r.status_code in RETRY_STATUSES and not last_attempt
+        _record(host, time.monotonic() - start, error=r.status_code >= 500, retry=retry)
+        if not retry:
+            return r
+        logger.info(f"Request to {host} returned {r.status_code}, retrying")
+        retry_after = r.headers.get('Retry-After')
+        if bucket is not None and r.status_code == 429 and retry_after is not None and retry_after.isdigit():
+            # Everyone sharing the bucket backs off, not just this request
+            bucket.pause(int(retry_after))
+        r.close()
+        _backoff(attempt, r.headers.get('Retry-After'))
@@ -0,0 +1,35 @@
+from config import config
+from connectors import database
+from helpers import metrics
+from helpers.ttl_cache import TTLCache
+
+# Telegram accepts at most 50 results per answer, the rest are served through next_offset
+PAGE_SIZE = 50
+
+# Normalized query -> rows, so repeated queries and the following pages of a query don't hit the database. Longer
+# queries aren't narrowed down from the rows of a shorter one: those are ranked for the shorter query, and it may
+# have matched them through another indexed name than the one displayed.
+cache = TTLCache(config.INLINE_CACHE_SIZE, config.INLINE_CACHE_TTL)
+metrics.register('inline_cache', cache.stats)
+
+
+def search(query):
+    key = ' '.join(query.lower().split())
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    limit = config.INLINE_SEARCH_LIMIT
+    series_rows = database.find_series_name_search(key, limit)
+    movie_rows = database.find_movie_name_search(key, limit)
+    rows = [('tv', row) for row in series_rows] + [('movie', row) for row in movie_rows]
+    cache.set(key, rows)
+    return rows
+
+
+def page(query, offset):
+    # Returns the rows for this page and the offset of the next one, '' when this is the last page
+    rows = search(query)
+    offset = int(offset) if offset and offset.isdigit() else 0
+    next_offset = offset + PAGE_SIZE
+    return rows[offset:next_offset], str(next_offset) if next_offset < len(rows) else ''
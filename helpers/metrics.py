@@ -0,0 +1,219 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Latency histograms and counters for the handlers and the external calls they make, plus the stats of the caches.
+# Exposed in Prometheus' text format on METRICS_PORT and summarised by the admin-only /stats command.
+
+# Upper bounds of the latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+lock = threading.Lock()
+histograms = {}
+counters = {}
+# name -> function returning a (possibly nested) dict of numbers, e.g. the hit and miss counts of a cache
+sources = {}
+# The timers running on this thread, innermost last, see mark_error()
+local = threading.local()
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, elapsed, error=False):
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if error:
+            self.errors += 1
+
+    def percentile(self, q):
+        # Interpolated linearly inside the bucket the q-th observation falls in, like Prometheus'
+        # histogram_quantile(), and never more than the slowest observation seen
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.buckets):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+
+def observe(name, elapsed, error=False):
+    with lock:
+        if name not in histograms:
+            histograms[name] = Histogram()
+        histograms[name].observe(elapsed, error)
+
+
+def increment(name, value=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    state = {'error': False}
+    if not hasattr(local, 'timers'):
+        local.timers = []
+    local.timers.append(state)
+    try:
+        yield
+    except BaseException:
+        state['error'] = True
+        raise
+    finally:
+        local.timers.pop()
+        observe(name, time.perf_counter() - start, state['error'])
+
+
+def mark_error():
+    # For code that handles its own exceptions, like the bot handlers: counts the innermost running timer as failed
+    timers = getattr(local, 'timers', None)
+    if timers:
+        timers[-1]['error'] = True
+
+
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register(name, func):
+    sources[name] = func
+
+
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(item, f'{prefix}.{key}' if prefix else str(key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def snapshot():
+    with lock:
+        stages = {name: {'count': h.count, 'errors': h.errors, 'p50': h.percentile(0.5), 'p95': h.percentile(0.95),
+                         'max': h.max, 'avg': h.total / h.count if h.count else 0.0}
+                  for name, h in histograms.items()}
+        result = {'stages': stages, 'counters': dict(counters)}
+    for name, func in list(sources.items()):
+        try:
+            result[name] = func()
+        except Exception as e:
+            logger.error(f"Failed to collect the {name} stats: {e}")
+    return result
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus():
+    lines = ['# TYPE bot_stage_seconds histogram']
+    with lock:
+        for name, h in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h.buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'bot_stage_seconds_bucket{{stage="{_label(name)}",le="{le}"}} {cumulative}')
+            lines.append(f'bot_stage_seconds_sum{{stage="{_label(name)}"}} {h.total}')
+            lines.append(f'bot_stage_seconds_count{{stage="{_label(name)}"}} {h.count}')
+        lines.append('# TYPE bot_stage_errors_total counter')
+        for name, h in sorted(histograms.items()):
+            lines.append(f'bot_stage_errors_total{{stage="{_label(name)}"}} {h.errors}')
+        lines.append('# TYPE bot_events_total counter')
+        for name, value in sorted(counters.items()):
+            lines.append(f'bot_events_total{{event="{_label(name)}"}} {value}')
+    lines.append('# TYPE bot_stat gauge')
+    for name, func in sorted(sources.items()):
+        try:
+            values = func()
+        except Exception as e:
+            logger.error(f"Failed to collect the {name} stats: {e}")
+            continue
+        for key, value in _flatten(values):
+            lines.append(f'bot_stat{{source="{_label(name)}",key="{_label(key)}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def hit_rate(hits, total):
+    return f"{hits / total:.0%}" if total else "-"
+
+
+def format_stats():
+    # Plain text summary for the /stats command
+    data = snapshot()
+    lines = [f"{'stage':<28} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8}"]
+    for name, stage in sorted(data['stages'].items()):
+        lines.append(f"{name[:28]:<28} {stage['count']:>6} {stage['errors']:>4} {stage['p50'] * 1000:>8.1f} "
+                     f"{stage['p95'] * 1000:>8.1f}")
+    lines.append("")
+    for name in sorted(sources):
+        values = data.get(name)
+        if isinstance(values, dict) and 'misses' in values:
+            # Caches with several tiers count their hits per tier, e.g. memory_hits and db_hits
+            hits = sum(value for key, value in values.items() if key.endswith('hits'))
+            total = hits + values['misses'] + values.get('revalidated', 0)
+            lines.append(f"{name}: {hit_rate(hits, total)} hits of {total}")
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name}: {value}")
+    return '\n'.join(lines)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = render_prometheus().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(snapshot(), default=str).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    # Local only by default, the endpoint isn't authenticated
+    if not config.METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer((config.METRICS_LISTEN, config.METRICS_PORT), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on {config.METRICS_LISTEN}:{config.METRICS_PORT}/metrics")
+    return server
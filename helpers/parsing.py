@@ -0,0 +1,71 @@
+from typing import NamedTuple
+from urllib.parse import urljoin
+from lxml import etree, html
+import logging
+
+logger = logging.getLogger(__name__)
+
+# All the baiscope HTML scraping lives here. Pages are parsed with lxml and only the few elements we need are
+# pulled out with XPath, which is several times faster than building a full BeautifulSoup tree of every page.
+
+
+class Post(NamedTuple):
+    title: str
+    link: str
+    # Category names of the post, e.g. ['TV Series', 'Action']
+    categories: list
+
+
+class SearchPage(NamedTuple):
+    posts: list
+    max_page: int
+
+
+def _has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+# Plain strings rather than compiled etree.XPath objects, those can't be shared between the crawler threads
+POST_TITLES = f'//h2[{_has_class("entry-title")}]'
+TITLE_LINK = './/a[@href]'
+# The cat-links span following the title, like BeautifulSoup's find_next
+CATEGORIES = f'following::span[{_has_class("cat-links")}][1]//a'
+PAGE_NUMBERS = f'//a[{_has_class("page-numbers")}]'
+DOWNLOAD_LINKS = '//a[contains(@href, "/?tmstv=")]/@href'
+
+
+def _document(text):
+    if not text or not text.strip():
+        return None
+    try:
+        return html.fromstring(text)
+    except (etree.ParserError, ValueError) as e:
+        logger.error(f"Failed to parse page: {e}")
+        return None
+
+
+def parse_search_page(text):
+    doc = _document(text)
+    if doc is None:
+        return SearchPage([], 1)
+
+    posts = []
+    for h2 in doc.xpath(POST_TITLES):
+        links = h2.xpath(TITLE_LINK)
+        if not links:
+            continue
+        categories = [a.text_content().strip() for a in h2.xpath(CATEGORIES)]
+        posts.append(Post(links[0].text_content(), links[0].get('href'), categories))
+
+    page_numbers = [a.text_content() for a in doc.xpath(PAGE_NUMBERS)]
+    max_page = max((int(number) for number in page_numbers if number.isdigit()), default=1)
+    return SearchPage(posts, max_page)
+
+
+def find_download_link(text, page_url):
+    # The archive link of a subtitle post, absolute, or None when the post has none
+    doc = _document(text)
+    if doc is None:
+        return None
+    links = doc.xpath(DOWNLOAD_LINKS)
+    return urljoin(page_url, links[0]) if links else None
@@ -0,0 +1,157 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from config import config
+from connectors import database
+from helpers import tmdb, telegram_files, season_bundle, downloads, rate_limit, subtitle_store
+from helpers.fetch_series import fetch_series
+from helpers.zip_helper import downloaded_bytes
+
+logger = logging.getLogger(__name__)
+
+# Pre-warms the titles people ask for most: refreshes their episodes, downloads the new subtitles and uploads them
+# once so the file_id is cached. It only works while no user request has come in for a little while.
+
+last_interactive = 0.0
+stop_event = threading.Event()
+
+
+def mark_interactive():
+    global last_interactive
+    last_interactive = time.monotonic()
+
+
+def note_request(kind, title_id):
+    # Called by the handlers, `kind` is 'movie' or 'series'
+    mark_interactive()
+    if config.PREWARM_INTERVAL <= 0:
+        # Nobody reads the requests, and run_cycle() wouldn't purge them either
+        return
+    try:
+        database.record_request(kind, str(title_id), time.time())
+    except Exception as e:
+        logger.error(f"Failed to record the request for {kind} {title_id}: {e}")
+
+
+class Budget:
+    # Bytes the current cycle may still download, shared by the workers
+
+    def __init__(self, total):
+        self.remaining = total
+        self.lock = threading.Lock()
+
+    def spend(self, size):
+        with self.lock:
+            self.remaining -= size
+
+    def exhausted(self):
+        return self.remaining <= 0
+
+
+def _wait_for_idle():
+    # Yield to interactive traffic, returns False when the scheduler is stopping
+    while time.monotonic() - last_interactive < config.PREWARM_IDLE_SECONDS:
+        if stop_event.wait(1):
+            return False
+    return not stop_event.is_set()
+
+
+def _download(budget, func, *args):
+    # Goes through the same single-flight downloads as the handlers, so a user asking for the title meanwhile
+    # just waits for this download
+    if budget.exhausted() or not _wait_for_idle():
+        return False
+    before = downloaded_bytes()
+    ok = func(*args)
+    budget.spend(downloaded_bytes() - before)
+    return ok
+
+
+def _upload(bot, files):
+    # Upload the files Telegram doesn't have yet, the cached file_id then makes the first real send instant
+    if not config.PREWARM_CHAT_ID:
+        return
+    for name, path in files:
+        if database.get_file_id(telegram_files.file_hash(path)) is None:
+            if not _wait_for_idle():
+                return
+            telegram_files.send_document(bot, config.PREWARM_CHAT_ID, path, name)
+
+
+def warm_movie(bot, movie_id, budget):
+    result = database.get_link(movie_id)
+    if result is None:
+        return
+    if not subtitle_store.has_files('movie', movie_id):
+        logger.info(f"Pre-downloading subtitles for movie_id {movie_id}")
+        _download(budget, downloads.download_movie, movie_id, result[0])
+    _upload(bot, subtitle_store.files('movie', movie_id))
+
+
+def warm_series(bot, series_id, budget):
+    results = database.check_series_available(series_id)
+    if results and results[0][6] != datetime.datetime.now().strftime('%Y-%m-%d'):
+        tmdb_response = tmdb.get_tv(series_id)
+        if tmdb_response is not None and _wait_for_idle():
+            logger.info(f"Refreshing series_id {series_id}")
+            year = tmdb_response['first_air_date'][:4]
+            fetch_series(config.HOST_URL, tmdb_response['name'], series_id, year, tmdb_response['overview'],
+                         tmdb_response['poster_path'], incremental=True)
+
+    for season in sorted({row[2] for row in database.check_series_available(series_id)}):
+        episodes = database.get_series_links(series_id, season)
+        landed = False
+        for season, episode, link, updated, series_name in episodes:
+            if not subtitle_store.has_files('series', series_id, season, episode):
+                logger.info(f"Pre-downloading subtitles for series_id {series_id} S{season}:E{episode}")
+                landed = _download(budget, downloads.download_episode, series_id, season, episode, link) or landed
+            _upload(bot, subtitle_store.files('series', series_id, season, episode))
+        if landed:
+            season_bundle.schedule_build(series_id, season, episodes[0][4])
+
+
+def run_cycle(bot):
+    now = time.time()
+    database.purge_title_requests(now - config.PREWARM_WINDOW)
+    titles = database.get_popular_titles(now - config.PREWARM_WINDOW, config.PREWARM_TOP)
+    logger.info(f"Pre-warming {len(titles)} popular title(s)")
+    budget = Budget(config.PREWARM_BANDWIDTH)
+
+    def warm(kind, title_id):
+        try:
+            with rate_limit.background():
+                if kind == 'movie':
+                    warm_movie(bot, title_id, budget)
+                else:
+                    warm_series(bot, title_id, budget)
+        except Exception as e:
+            logger.error(f"Failed to pre-warm {kind} {title_id}: {e}")
+
+    with ThreadPoolExecutor(max_workers=config.PREWARM_CONCURRENCY, thread_name_prefix='prewarm') as pool:
+        for kind, title_id, count in titles:
+            pool.submit(warm, kind, title_id)
+
+
+def _run(bot):
+    while not stop_event.wait(config.PREWARM_INTERVAL):
+        try:
+            run_cycle(bot)
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+
+
+def start(bot):
+    # Requests recorded before the last restart, or while pre-warming was still enabled, age out here too
+    try:
+        database.purge_title_requests(time.time() - config.PREWARM_WINDOW)
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+    if config.PREWARM_INTERVAL <= 0:
+        return
+    threading.Thread(target=_run, args=(bot,), name='prewarm', daemon=True).start()
+
+
+def stop():
+    stop_event.set()
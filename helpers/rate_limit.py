@@ -0,0 +1,189 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import telebot
+from telebot.apihelper import ApiTelegramException
+import logging
+from config import config
+from helpers import metrics
+from helpers.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Calls to TMDB and Telegram wait for a token from a bucket instead of running into 429s under bursts. Waiting calls
+# are queued, interactive ones ahead of background work (pre-warming, background refreshes), and a Retry-After
+# from the upstream pauses the whole bucket.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+local = threading.local()
+
+
+def current_priority():
+    return getattr(local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def priority(value):
+    previous = current_priority()
+    local.priority = value
+    try:
+        yield
+    finally:
+        local.priority = previous
+
+
+def background():
+    # Marks the calls made by this thread as background work, e.g. `with rate_limit.background(): ...`
+    return priority(BACKGROUND)
+
+
+def carry_priority(func):
+    # Wraps func so it runs with the caller's priority on a pool thread
+    caller_priority = current_priority()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with priority(caller_priority):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class TokenBucket:
+    # `rate` tokens per second, up to `burst` saved up. acquire() blocks until a token is free, waiters are served
+    # by priority and then in arrival order.
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiters = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=None):
+        entry = (current_priority() if priority is None else priority, next(self.counter))
+        start = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == entry and self.tokens >= 1 and now >= self.paused_until:
+                        self.tokens -= 1
+                        break
+                    if now < self.paused_until:
+                        timeout = self.paused_until - now
+                    elif self.tokens < 1:
+                        timeout = (1 - self.tokens) / self.rate
+                    else:
+                        # A token is free but someone ahead of us gets it first
+                        timeout = None
+                    self.condition.wait(timeout)
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            metrics.observe(f'rate_limit.{self.name}', waited)
+
+    def wait_resumed(self):
+        # Waits out a pause without taking a token
+        with self.condition:
+            while time.monotonic() < self.paused_until:
+                self.condition.wait(self.paused_until - time.monotonic())
+
+    def pause(self, seconds):
+        # The upstream told us to back off (Retry-After), nobody gets a token until then
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.condition.notify_all()
+        metrics.increment(f'rate_limit.{self.name}.paused')
+        logger.info(f"Rate limit {self.name} paused for {seconds}s")
+
+
+class BucketGroup:
+    # One bucket per key (e.g. per chat), created on first use and forgotten after a while unused
+
+    def __init__(self, name, rate, burst, max_size=10000, ttl=600):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(max_size, ttl)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.name, self.rate, self.burst)
+            # Refresh the TTL on every use
+            self.buckets.set(key, bucket)
+            return bucket
+
+
+tmdb = TokenBucket('tmdb', config.TMDB_RATE, config.TMDB_BURST)
+telegram = TokenBucket('telegram', config.TELEGRAM_RATE, config.TELEGRAM_BURST)
+telegram_chats = BucketGroup('telegram_chat', config.TELEGRAM_CHAT_RATE, config.TELEGRAM_CHAT_BURST)
+
+
+def _retry_after(e):
+    parameters = (e.result_json or {}).get('parameters') or {}
+    return parameters.get('retry_after') or 1
+
+
+def _throttled(method, chat_arg, per_chat=True):
+    # chat_arg is the position of chat_id in the method's arguments, None for methods that aren't sent to a chat.
+    # Calls with per_chat=False (edits and deletes) don't count against the chat's rate, they only respect a pause
+    # after Telegram flood-limited the chat.
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        chat_id = kwargs.get('chat_id', args[chat_arg] if chat_arg is not None and len(args) > chat_arg else None)
+        chat_bucket = telegram_chats.get(chat_id) if chat_id is not None else None
+        for attempt in range(config.TELEGRAM_RETRIES + 1):
+            if chat_bucket is not None:
+                if per_chat:
+                    chat_bucket.acquire()
+                else:
+                    chat_bucket.wait_resumed()
+            telegram.acquire()
+            try:
+                return method(self, *args, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt == config.TELEGRAM_RETRIES:
+                    raise
+                retry_after = _retry_after(e)
+                logger.info(f"Telegram asked to retry {method.__name__} after {retry_after}s")
+                # Flood limits are per chat when there is one, otherwise they hold for the whole bot
+                (chat_bucket or telegram).pause(retry_after)
+                # An upload has to start from the beginning again
+                for arg in itertools.chain(args, kwargs.values()):
+                    if hasattr(arg, 'seek'):
+                        arg.seek(0)
+    return wrapper
+
+
+class ThrottledTeleBot(telebot.TeleBot):
+    # TeleBot whose outgoing calls go through the Telegram buckets and are retried after a 429
+
+    send_message = _throttled(telebot.TeleBot.send_message, 0)
+    send_photo = _throttled(telebot.TeleBot.send_photo, 0)
+    send_document = _throttled(telebot.TeleBot.send_document, 0)
+    edit_message_text = _throttled(telebot.TeleBot.edit_message_text, 1, per_chat=False)
+    delete_message = _throttled(telebot.TeleBot.delete_message, 0, per_chat=False)
+    answer_inline_query = _throttled(telebot.TeleBot.answer_inline_query, None)
+    answer_callback_query = _throttled(telebot.TeleBot.answer_callback_query, None)
@@ -0,0 +1,120 @@
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import time
+import logging
+from config import config
+from helpers import http_client, parsing, metrics
+from helpers.single_flight import SingleFlight
+from helpers.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=config.SEARCH_WORKERS, thread_name_prefix='search')
+
+# Parsed search pages shared by /movie, /tv and the series scrapers, keyed by (host, normalized query, page)
+page_cache = TTLCache(config.SEARCH_CACHE_SIZE, config.SEARCH_CACHE_MAX_AGE)
+# Concurrent requests for the same page share one fetch
+flights = SingleFlight()
+stats = {'hits': 0, 'revalidated': 0, 'misses': 0}
+stats_lock = threading.Lock()
+
+
+def _count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+def search_page_url(host_url, query, page):
+    if page == 1:
+        return f'{host_url}/?s={quote_plus(query)}'
+    return f'{host_url}/page/{page}/?s={quote_plus(query)}'
+
+
+def normalize_query(query):
+    # WordPress search ignores case and extra whitespace, so these all share one cache entry
+    return ' '.join(query.lower().split())
+
+
+def _fetch(url, cached):
+    headers = {}
+    if cached is not None:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    r = http_client.get(url, headers=headers)
+    if r.status_code == 304 and cached is not None:
+        _count('revalidated')
+        return dict(cached, fetched_at=time.monotonic())
+    _count('misses')
+    with metrics.timer('parse.search_page'):
+        page = parsing.parse_search_page(r.text)
+    return {'page': page, 'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'), 'fetched_at': time.monotonic(), 'ok': r.ok}
+
+
+def fetch_search_page(host_url, query, page):
+    # Search pages are cached for SEARCH_CACHE_TTL seconds, so e.g. `/tv name` followed by `/s_id` scrapes them once.
+    # Older entries are kept until SEARCH_CACHE_MAX_AGE to revalidate them with a conditional request.
+    query = normalize_query(query)
+    key = (host_url, query, page)
+    cached = page_cache.get(key)
+    if cached is not None and time.monotonic() - cached['fetched_at'] < config.SEARCH_CACHE_TTL:
+        _count('hits')
+        return cached['page']
+
+    url = search_page_url(host_url, query, page)
+    entry = flights.do(key, lambda report: _fetch(url, cached))
+    if entry['ok']:
+        page_cache.set(key, entry)
+    return entry['page']
+
+
+def cache_stats():
+    with stats_lock:
+        return dict(stats, size=len(page_cache))
+
+
+metrics.register('search_cache', cache_stats)
+
+
+def crawl_search(host_url, query, window=None):
+    # Yields the parsed search result pages in page order. The first page is fetched once and tells us how many
+    # pages there are. Nothing more is fetched until the consumer asks for the next page, then the look-ahead grows
+    # by a page with every page consumed, up to `window` pages, so a consumer that stops early (e.g. `break` inside
+    # `with closing(...)`) only costs the pages it asked for plus the few already in flight. window=1 fetches the
+    # pages strictly one after the other.
+    window = window or config.SEARCH_WINDOW
+    first_page = fetch_search_page(host_url, query, 1)
+    max_page = first_page.max_page
+    logger.info(f"Total number of pages found: {max_page}")
+
+    pending = deque()
+    next_page = 2
+
+    def submit_next():
+        nonlocal next_page
+        if next_page <= max_page:
+            pending.append((next_page, executor.submit(fetch_search_page, host_url, query, next_page)))
+            next_page += 1
+
+    try:
+        yield first_page
+        consumed = 1
+        while next_page <= max_page or pending:
+            # The consumer wants another page: start it along with the look-ahead
+            while next_page <= max_page and len(pending) < min(window, consumed):
+                submit_next()
+            page, future = pending.popleft()
+            consumed += 1
+            try:
+                page_result = future.result()
+            except Exception as e:
+                logger.error(f"Failed to fetch search page {page} for {query}: {e}")
+                continue
+            yield page_result
+    finally:
+        for page, future in pending:
+            future.cancel()
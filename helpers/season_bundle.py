@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from helpers import subtitle_store
+
+logger = logging.getLogger(__name__)
+
+# One background builder is plenty, bundles are small and built incrementally
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bundle')
+locks = {}
+locks_lock = threading.Lock()
+
+# Season zips are built from the store, they can always be rebuilt
+BUNDLE_DIR = 'subtitles/bundles'
+
+
+def _lock(series_id, season):
+    with locks_lock:
+        # Callers pass ids as ints or, when walking the bundle directories, as strings
+        return locks.setdefault((str(series_id), str(season)), threading.Lock())
+
+
+def bundle_path(series_id, season, series_name):
+    return os.path.join(f'{BUNDLE_DIR}/{series_id}/{season}', f'{series_name} - Season {season}.zip')
+
+
+def _season_files(series_id, season):
+    # {arcname: path} for every subtitle file of the season in the store
+    return {f'{episode}/{name}': path for episode, name, path in subtitle_store.season_files(series_id, season)}
+
+
+def _load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_manifest(path, manifest):
+    tmp_path = path + '.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _write_bundle(zip_path, files, mode):
+    with zipfile.ZipFile(zip_path, mode, zipfile.ZIP_DEFLATED) as zipf:
+        for arcname in sorted(files):
+            zipf.write(files[arcname], arcname=arcname)
+
+
+def build_bundle(series_id, season, series_name):
+    # Brings the season zip up to date with the episode files in the store and returns its path. Only new episode
+    # files are appended, the zip is rebuilt from scratch when a file it already holds changed or went away.
+    zip_path = bundle_path(series_id, season, series_name)
+    manifest_path = zip_path + '.manifest.json'
+    with _lock(series_id, season):
+        files = _season_files(series_id, season)
+        # The manifest maps the arcnames to their hashes, blobs are named after their hash
+        hashes = {arcname: os.path.basename(path) for arcname, path in files.items()}
+        manifest = _load_manifest(manifest_path) if os.path.exists(zip_path) else None
+
+        if manifest is not None and all(hashes.get(arcname) == content_hash
+                                        for arcname, content_hash in manifest.items()):
+            new_files = {arcname: file for arcname, file in files.items() if arcname not in manifest}
+            if not new_files:
+                # The mtime tells the disk quota when the zip was last used
+                os.utime(zip_path)
+                return zip_path
+            logger.info(f"Appending {len(new_files)} file(s) to {zip_path}")
+            # Append to a copy, the zip may be being uploaded right now
+            tmp_path = zip_path + '.part'
+            try:
+                shutil.copyfile(zip_path, tmp_path)
+                _write_bundle(tmp_path, new_files, 'a')
+                os.replace(tmp_path, zip_path)
+                _save_manifest(manifest_path, hashes)
+                return zip_path
+            except zipfile.BadZipFile as e:
+                logger.error(f"{zip_path} is corrupted, rebuilding it: {e}")
+
+        logger.info(f"Building {zip_path} with {len(files)} file(s)")
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        tmp_path = zip_path + '.part'
+        _write_bundle(tmp_path, files, 'w')
+        os.replace(tmp_path, zip_path)
+        _save_manifest(manifest_path, hashes)
+        return zip_path
+
+
+def season_dirs():
+    # [(series_id, season, directory)] of every season that has a zip
+    result = []
+    for series_id in os.listdir(BUNDLE_DIR) if os.path.isdir(BUNDLE_DIR) else []:
+        series_dir = os.path.join(BUNDLE_DIR, series_id)
+        for season in os.listdir(series_dir) if os.path.isdir(series_dir) else []:
+            result.append((series_id, season, os.path.join(series_dir, season)))
+    return result
+
+
+def remove_bundle(series_id, season):
+    # Deletes the season zip, the next "Download All" builds it again
+    with _lock(series_id, season):
+        shutil.rmtree(os.path.join(BUNDLE_DIR, str(series_id), str(season)), ignore_errors=True)
+
+
+def schedule_build(series_id, season, series_name):
+    # Build in the background when episodes land, so the next "Download All" is served straight away
+    def build():
+        try:
+            build_bundle(series_id, season, series_name)
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+
+    executor.submit(build)
@@ -0,0 +1,33 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from config import config
+from helpers import rate_limit
+from helpers.fetch_series import fetch_series
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=config.REFRESH_WORKERS, thread_name_prefix='refresh')
+in_flight = set()
+lock = threading.Lock()
+
+
+def refresh_in_background(host_url, series_name, series_id, year, overview, poster):
+    # Stale-while-revalidate: the caller keeps serving what is in the database while the new episodes are looked
+    # for here. Returns False when a refresh of this series is already running.
+    with lock:
+        if series_id in in_flight:
+            return False
+        in_flight.add(series_id)
+
+    def refresh():
+        try:
+            logger.info(f"Refreshing series_id {series_id} in the background")
+            with rate_limit.background():
+                fetch_series(host_url, series_name, series_id, year, overview, poster, incremental=True)
+        finally:
+            with lock:
+                in_flight.discard(series_id)
+
+    executor.submit(refresh)
+    return True
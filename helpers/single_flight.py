@@ -0,0 +1,75 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.listeners = []
+        self.last_report = None
+
+
+class SingleFlight:
+    # Runs at most one job per key at a time. Callers asking for a key that is already running wait for that job
+    # and get its result (or its exception) instead of starting their own. Every caller can pass a progress
+    # callback, the job's report() calls all of them.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def in_flight(self, key):
+        with self.lock:
+            return key in self.calls
+
+    def do(self, key, func, progress=None):
+        # func is called as func(report), report(*args) forwards to the progress callbacks
+        last_report = None
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+            if progress is not None:
+                call.listeners.append(progress)
+                last_report = call.last_report
+        if last_report is not None:
+            # Catch up a late joiner with the latest progress. Outside the lock, callbacks like Telegram edits can
+            # take a while and would hold up every other key.
+            self._notify(progress, last_report)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        def report(*args):
+            with self.lock:
+                call.last_report = args
+                listeners = list(call.listeners)
+            for listener in listeners:
+                self._notify(listener, args)
+
+        try:
+            call.result = func(report)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    @staticmethod
+    def _notify(listener, args):
+        try:
+            listener(*args)
+        except Exception as e:
+            logger.error(f"Progress callback failed: {e}")
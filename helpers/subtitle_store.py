@@ -0,0 +1,128 @@
+import hashlib
+import os
+import shutil
+import time
+import logging
+from connectors import database
+from helpers.archive import is_subtitle
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed subtitle store. Every subtitle file is kept once, under subtitles/blobs/<hash[:2]>/<hash>, however
+# many movies, episodes or archives it belongs to. The title_files table lists the files (name and hash) of a movie
+# or episode, archive_files the files a post or archive URL gave us. Movies are stored with season and episode 0.
+
+BLOB_DIR = 'subtitles/blobs'
+# Archives are extracted here, then the subtitles are moved into the store
+STAGING_DIR = 'subtitles/.staging'
+# Per-title directories used before the store, imported by import_legacy()
+LEGACY_MOVIES_DIR = 'subtitles/movies'
+LEGACY_SERIES_DIR = 'subtitles/series'
+
+
+def blob_path(content_hash):
+    return os.path.join(BLOB_DIR, content_hash[:2], content_hash)
+
+
+def _hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def add_file(path):
+    # Moves the file into the store and returns its hash, a file we already have is just deleted
+    content_hash = _hash(path)
+    target = blob_path(content_hash)
+    size = os.path.getsize(path)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    database.add_blob(content_hash, size, time.time())
+    return content_hash
+
+
+def ingest(directory):
+    # Adds the subtitle files of a directory (e.g. an extracted archive) and returns them as [(name, hash)]
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and is_subtitle(name):
+            files.append((name, add_file(path)))
+    return files
+
+
+def _touch(hashes):
+    # Records the use for the disk quota's LRU eviction, see helpers/disk_quota.py
+    if hashes:
+        database.touch_blobs(sorted(set(hashes)), time.time())
+
+
+def files(kind, title_id, season=0, episode=0):
+    # [(name, path)] of a movie or an episode, empty when we don't have its subtitles or one of them was evicted
+    rows = database.get_title_files(kind, str(title_id), int(season), int(episode))
+    if not rows or not all(os.path.exists(blob_path(content_hash)) for name, content_hash in rows):
+        return []
+    _touch([content_hash for name, content_hash in rows])
+    return [(name, blob_path(content_hash)) for name, content_hash in rows]
+
+
+def has_files(kind, title_id, season=0, episode=0):
+    return bool(files(kind, title_id, season, episode))
+
+
+def link(kind, title_id, season, episode, title_files):
+    database.set_title_files(kind, str(title_id), int(season), int(episode), title_files)
+
+
+def season_files(series_id, season):
+    # [(episode, name, path)] of every episode of the season we have subtitles for
+    rows = [(episode, name, content_hash)
+            for episode, name, content_hash in database.get_season_files(str(series_id), int(season))
+            if os.path.exists(blob_path(content_hash))]
+    _touch([content_hash for episode, name, content_hash in rows])
+    return [(episode, name, blob_path(content_hash)) for episode, name, content_hash in rows]
+
+
+def archive_files(url):
+    # [(name, hash)] a post or archive URL gave us before, empty if it was never fetched or a file went missing
+    rows = database.get_archive_files(url)
+    if rows and all(os.path.exists(blob_path(content_hash)) for name, content_hash in rows):
+        return rows
+    return []
+
+
+def record_archive(url, archive_files):
+    database.set_archive_files(url, archive_files)
+
+
+def _import_dir(directory, kind, title_id, season, episode):
+    title_files = ingest(directory)
+    if title_files:
+        link(kind, title_id, season, episode, title_files)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def import_legacy():
+    # Moves subtitles/movies/<id> and subtitles/series/<id>/<season>/<episode> into the store, once. The season zips
+    # that lived next to the episodes are dropped and rebuilt on demand.
+    if os.path.isdir(LEGACY_MOVIES_DIR):
+        for movie_id in os.listdir(LEGACY_MOVIES_DIR):
+            _import_dir(os.path.join(LEGACY_MOVIES_DIR, movie_id), 'movie', movie_id, 0, 0)
+        shutil.rmtree(LEGACY_MOVIES_DIR, ignore_errors=True)
+        logger.info("Imported the movie subtitles into the subtitle store")
+    if os.path.isdir(LEGACY_SERIES_DIR):
+        for series_id in os.listdir(LEGACY_SERIES_DIR):
+            series_dir = os.path.join(LEGACY_SERIES_DIR, series_id)
+            for season in os.listdir(series_dir) if os.path.isdir(series_dir) else []:
+                season_dir = os.path.join(series_dir, season)
+                for episode in os.listdir(season_dir) if os.path.isdir(season_dir) else []:
+                    episode_dir = os.path.join(season_dir, episode)
+                    if os.path.isdir(episode_dir) and season.isdigit() and episode.isdigit():
+                        _import_dir(episode_dir, 'series', series_id, int(season), int(episode))
+        shutil.rmtree(LEGACY_SERIES_DIR, ignore_errors=True)
+        logger.info("Imported the series subtitles into the subtitle store")
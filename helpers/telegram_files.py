@@ -0,0 +1,48 @@
+import hashlib
+import os
+from functools import lru_cache
+from telebot.apihelper import ApiTelegramException
+import logging
+from connectors import database
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=4096)
+def _hash(path, mtime_ns, size):
+    # mtime and size are part of the cache key, so a rewritten file gets hashed again
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    return _hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+@metrics.timed('telegram.send_document')
+def send_document(bot, chat_id, path, name=None):
+    # Telegram keeps every file we upload, so a file is only uploaded the first time and then re-sent by its file_id.
+    # `name` is the file name users see, by default the name of the file on disk.
+    content_hash = file_hash(path)
+    file_id = database.get_file_id(content_hash)
+    if file_id:
+        try:
+            sent = bot.send_document(chat_id, file_id)
+            metrics.increment('telegram.file_id_reused')
+            return sent
+        except ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            logger.info(f"Telegram rejected the cached file_id for {path}, uploading it again: {e}")
+            database.delete_file_id(content_hash)
+
+    with open(path, 'rb') as f:
+        sent = bot.send_document(chat_id, f, visible_file_name=name)
+    metrics.increment('telegram.uploaded')
+    database.set_file_id(content_hash, path, sent.document.file_id)
+    return sent
@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlencode
+import json
+import time
+import threading
+import logging
+from config import config
+from connectors import database
+from helpers import http_client, metrics, rate_limit
+from helpers.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+TMDB_API_URL = config.TMDB_API_URL
+
+# Shared pool so a burst of /movie requests can't open an unbounded number of TMDB connections
+executor = ThreadPoolExecutor(max_workers=config.TMDB_WORKERS, thread_name_prefix='tmdb')
+
+# Two cache tiers sit in front of TMDB: a small in-process LRU and a SQLite table that survives restarts
+memory_cache = TTLCache(config.TMDB_CACHE_SIZE, config.TMDB_MEMORY_TTL)
+stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+stats_lock = threading.Lock()
+_missing = object()
+
+
+def _count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+def cache_stats():
+    with stats_lock:
+        return dict(stats, memory_size=len(memory_cache))
+
+
+metrics.register('tmdb_cache', cache_stats)
+
+
+def _is_empty(data):
+    # 404s and searches without results are cached for a shorter time, new titles show up on TMDB every day
+    return data is None or ('results' in data and not data['results'])
+
+
+@metrics.timed('tmdb')
+def _get(path, params=None):
+    params = params or {}
+    cache_key = f'{path}?{urlencode(sorted(params.items()))}'
+
+    data = memory_cache.get(cache_key, default=_missing)
+    if data is not _missing:
+        _count('memory_hits')
+        return data
+
+    cached = database.get_tmdb_cache(cache_key)
+    now = time.time()
+    if cached and cached[1] > now:
+        _count('db_hits')
+        data = json.loads(cached[0])
+        memory_cache.set(cache_key, data, min(config.TMDB_MEMORY_TTL, cached[1] - now))
+        return data
+
+    _count('misses')
+    r = http_client.get(f'{TMDB_API_URL}/{path}', params=dict(params, api_key=config.TMDB_API_KEY),
+                     timeout=config.TMDB_TIMEOUT, bucket=rate_limit.tmdb)
+    if r.status_code == 404:
+        data = None
+    else:
+        r.raise_for_status()
+        data = r.json()
+
+    ttl = config.TMDB_NEGATIVE_TTL if _is_empty(data) else config.TMDB_CACHE_TTL
+    memory_cache.set(cache_key, data, min(config.TMDB_MEMORY_TTL, ttl))
+    try:
+        database.set_tmdb_cache(cache_key, json.dumps(data), now + ttl)
+    except Exception as e:
+        logger.error(f"Failed to store TMDB response for {path} in the cache: {e}")
+    return data
+
+
+def search_movie(query):
+    return _get('search/movie', {'query': query})
+
+
+def search_tv(query):
+    return _get('search/tv', {'query': query})
+
+
+def get_tv(series_id):
+    # Returns None when TMDB doesn't know the series
+    return _get(f'tv/{series_id}')
+
+
+def new_deadline():
+    # The time.monotonic() by which all the lookups of a request have to be done
+    return time.monotonic() + config.TMDB_DEADLINE
+
+
+def _gather(func, queries, deadline=None):
+    # Run the lookups concurrently. The results keep the order of the queries, and a lookup that fails or misses
+    # the deadline comes back as None instead of failing the whole batch. Pass the same deadline to every batch of
+    # a request so they share one time budget.
+    if deadline is None:
+        deadline = new_deadline()
+    func = rate_limit.carry_priority(func)
+    futures = [executor.submit(func, query) for query in queries]
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in not_done:
+        future.cancel()
+
+    results = []
+    for query, future in zip(queries, futures):
+        if future not in done:
+            logger.error(f"TMDB lookup for {query} missed the deadline")
+            results.append(None)
+        elif future.exception() is not None:
+            logger.error(f"TMDB lookup for {query} failed: {future.exception()}")
+            results.append(None)
+        else:
+            results.append(future.result())
+    return results
+
+
+def search_movies(queries, deadline=None):
+    return _gather(search_movie, queries, deadline)
+
+
+def search_tvs(queries, deadline=None):
+    return _gather(search_tv, queries, deadline)
+
+
+def purge_cache():
+    database.purge_tmdb_cache(time.time())
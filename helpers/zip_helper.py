@@ -1,93 +1,116 @@
-import requests
-from bs4 import BeautifulSoup
-import zipfile
+from helpers import http_client, parsing, metrics
 import os
-from urllib.parse import urljoin, urlparse, unquote
+from urllib.parse import urlparse, unquote
 import shutil
-import rarfile
-import logging
-import py7zr
 import logging
+import tempfile
+import threading
+import time
+from config import config
+from helpers.archive import extract_subtitles, is_subtitle, ArchiveLimitExceeded, BAD_ARCHIVE_ERRORS
 
 logger = logging.getLogger(__name__)
 
 
-def download_extract_zip(link, chat_dir, bot, msg):
+# Bytes downloaded by the current thread, lets background jobs keep to a bandwidth budget
+local = threading.local()
+
+
+class ArchiveTooLarge(Exception):
+    pass
+
+
+def downloaded_bytes():
+    return getattr(local, 'downloaded_bytes', 0)
+
+
+def _stream_to_file(r, path):
+    # Write the response body to a temp file next to `path` chunk by chunk, so memory stays flat however big the
+    # archive is, and only rename it into place once it's complete
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    size = 0
+    start = time.monotonic()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > config.MAX_ARCHIVE_SIZE:
+                    raise ArchiveTooLarge(f"{r.url} is over the {config.MAX_ARCHIVE_SIZE} bytes limit")
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    elapsed = time.monotonic() - start
+    local.downloaded_bytes = downloaded_bytes() + size
+    http_client.record_download(urlparse(r.url).netloc, size, elapsed)
+    metrics.observe('download.archive', elapsed)
+    logger.info(f"Downloaded {size} bytes in {elapsed:.2f}s ({size / max(elapsed, 1e-6) / 1024:.1f} KiB/s)")
+
+
+def find_archive_url(link):
+    # The archive behind a baiscope post, None when the post has no download link
+    r = http_client.get(link)
+    return parsing.find_download_link(r.text, link)
+
+
+def download_extract_zip(link, chat_dir, bot, msg, zip_url=None):
+    # zip_url can be passed when the archive URL of the post is already known
     try:
         logger.info(f"Downloading subtitles from {link} to {chat_dir}")
 
         # Download the zip file
-        r = requests.get(link)
-        soup = BeautifulSoup(r.text, 'html.parser')
-        for a in soup.find_all('a', href=True):
-            if '/?tmstv=' in a['href']:
-                zip_url = urljoin(link, a['href'])
-                break
-                break
-        r = requests.get(zip_url)
-        parsed_url = urlparse(zip_url)
-        file_name = os.path.basename(unquote(parsed_url.path))
-        if not file_name:
-            content_type = r.headers.get('Content-Type', '')
-            if 'zip' in content_type:
-                file_name = 'default.zip'
-            elif 'x-rar-compressed' in content_type:
-                file_name = 'default.rar'
-            elif '7z' in content_type:
-                file_name = 'default.7z'
+        if zip_url is None:
+            zip_url = find_archive_url(link)
+        if zip_url is None:
+            logger.error(f"No download link found on {link}")
+            return False
+        with http_client.get(zip_url, stream=True) as r:
+            r.raise_for_status()
+            # Refuse oversized archives before reading the body when the server tells us the size
+            content_length = r.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > config.MAX_ARCHIVE_SIZE:
+                logger.error(f"Archive {zip_url} is {content_length} bytes, over the {config.MAX_ARCHIVE_SIZE} limit")
+                return False
+            parsed_url = urlparse(zip_url)
+            file_name = os.path.basename(unquote(parsed_url.path))
+            if not file_name:
+                content_type = r.headers.get('Content-Type', '')
+                if 'zip' in content_type:
+                    file_name = 'default.zip'
+                elif 'x-rar-compressed' in content_type:
+                    file_name = 'default.rar'
+                elif '7z' in content_type:
+                    file_name = 'default.7z'
+                else:
+                    file_name = 'default.zip'
             else:
-                file_name = 'default.zip'
-        else:
-            _, ext = os.path.splitext(file_name)
-            if ext not in ['.zip', '.rar', '.7z']:
-                file_name = 'default' + ext
-        zip_file_name = os.path.join(chat_dir, file_name)
-        with open(zip_file_name, 'wb') as f:
-            f.write(r.content)
+                _, ext = os.path.splitext(file_name)
+                if ext not in ['.zip', '.rar', '.7z']:
+                    file_name = 'default' + ext
+            zip_file_name = os.path.join(chat_dir, file_name)
+            _stream_to_file(r, zip_file_name)
 
         logger.info(f"Downloaded zip file {zip_file_name}")
 
-        # Extract the subtitle files
-        try:
-            if zip_file_name.endswith('.zip'):
-                with zipfile.ZipFile(zip_file_name, 'r') as zip_ref:
-                    zip_ref.extractall(chat_dir)
-            elif zip_file_name.endswith('.rar'):
-                with rarfile.RarFile(zip_file_name, 'r') as rar_ref:
-                    rar_ref.extractall(chat_dir)
-            elif zip_file_name.endswith('.7z'):
-                with py7zr.SevenZipFile(zip_file_name, mode='r') as z:
-                    z.extractall(path=chat_dir)
-        except (zipfile.BadZipFile, rarfile.BadRarFile, py7zr.exceptions.Bad7zFile):
-            shutil.rmtree(chat_dir)
-            bot.edit_message_text("😰 Some files are corrupted. Trying to upload the rest..", msg.chat.id, msg.message_id,
-                                  parse_mode='Markdown')
-            logger.error(f"Failed to extract subtitles from {zip_file_name}")
-            return
+        # Extract the subtitle files, a subtitle downloaded as is doesn't need extracting
+        if zip_file_name.endswith(('.zip', '.rar', '.7z')):
+            try:
+                extract_subtitles(zip_file_name, chat_dir)
+            except (ArchiveLimitExceeded, *BAD_ARCHIVE_ERRORS) as e:
+                shutil.rmtree(chat_dir)
+                if msg is not None:
+                    bot.edit_message_text("😰 Some files are corrupted. Trying to upload the rest..", msg.chat.id,
+                                          msg.message_id, parse_mode='Markdown')
+                logger.error(f"Failed to extract subtitles from {zip_file_name}: {e}")
+                return False
+            os.remove(zip_file_name)
+        elif not is_subtitle(zip_file_name):
+            os.remove(zip_file_name)
 
         logger.info(f"Extracted subtitles to {chat_dir}")
-
-        # Check if there are any subtitle files in the main directory
-        srt_files = [file for file in os.listdir(chat_dir) if file.endswith('.srt')]
-        if not srt_files:
-            # No .srt files found in the main directory, find them in subdirectories
-            for root, dirs, files in os.walk(chat_dir):
-                for file in files:
-                    if file.endswith(('.srt', '.ass', '.ssa', '.vtt', '.stl', '.scc', '.ttml', '.sbv', '.idx', '.sub')):
-                        # Move the .srt file to the main directory
-                        shutil.move(os.path.join(root, file), chat_dir)
-
-        logger.info(f"Moved .srt files to {chat_dir}")
-
-        # Delete all files that are not subtitle files
-        for root, dirs, files in os.walk(chat_dir, topdown=False):
-            for file in files:
-                if not file.endswith(('.srt', '.ass', '.ssa', '.vtt', '.stl', '.scc', '.ttml', '.sbv', '.idx', '.sub')):
-                    os.remove(os.path.join(root, file))
-            for dir in dirs:
-                shutil.rmtree(os.path.join(root, dir))
-
-        logger.info(f"Cleaned up {chat_dir}")
+        return True
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+        return False
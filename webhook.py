@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from telebot import types
+from config import config
+from config.logging import logger
+from bot import bot
+from helpers import prewarm, metrics
+
+# Webhook entry point, an alternative to `python3 bot.py` (long polling). Updates are received by an asyncio web
+# server and put on a bounded queue. A fixed number of workers take them off the queue and run the usual handlers
+# from bot.py on a thread pool, so blocking work like scraping and archive extraction never stalls the event loop.
+# When the queue is full new updates are dropped instead of piling up.
+
+WEBHOOK_PATH = f'/{config.TOKEN}'
+stats = {'received': 0, 'processed': 0, 'dropped': 0, 'failed': 0}
+metrics.register('webhook', lambda: dict(stats))
+
+
+async def receive_update(request):
+    if config.WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != config.WEBHOOK_SECRET:
+        return web.Response(status=403)
+    update = types.Update.de_json(await request.text())
+    stats['received'] += 1
+    try:
+        request.app['queue'].put_nowait(update)
+    except asyncio.QueueFull:
+        # Still answer 200, otherwise Telegram keeps retrying the update and makes the overload worse
+        stats['dropped'] += 1
+        logger.error(f"Update queue is full, dropped update {update.update_id}")
+    return web.Response()
+
+
+async def worker(app):
+    loop = asyncio.get_running_loop()
+    queue = app['queue']
+    while True:
+        update = await queue.get()
+        try:
+            await loop.run_in_executor(app['executor'], bot.process_new_updates, [update])
+            stats['processed'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"An error occurred: {e}")
+        finally:
+            queue.task_done()
+
+
+async def on_startup(app):
+    app['queue'] = asyncio.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE)
+    app['executor'] = ThreadPoolExecutor(max_workers=config.WEBHOOK_CONCURRENCY, thread_name_prefix='handler')
+    app['workers'] = [asyncio.create_task(worker(app)) for _ in range(config.WEBHOOK_CONCURRENCY)]
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: bot.set_webhook(url=config.WEBHOOK_URL + WEBHOOK_PATH,
+                                                              secret_token=config.WEBHOOK_SECRET or None,
+                                                              max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                                                              drop_pending_updates=False))
+    logger.info(f"Webhook set, handling updates with {config.WEBHOOK_CONCURRENCY} workers")
+
+
+async def on_cleanup(app):
+    # Let the updates already queued finish before shutting down
+    try:
+        await asyncio.wait_for(app['queue'].join(), timeout=30)
+    except asyncio.TimeoutError:
+        logger.error(f"Shutting down with {app['queue'].qsize()} update(s) still queued")
+    for task in app['workers']:
+        task.cancel()
+    app['executor'].shutdown(wait=False)
+
+
+def create_app():
+    # The handlers run on our executor, telebot's own worker pool isn't used in this mode
+    bot.threaded = False
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    metrics.start_server()
+    prewarm.start(bot)
+    web.run_app(create_app(), host=config.WEBHOOK_LISTEN, port=config.WEBHOOK_PORT)